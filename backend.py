@@ -1,47 +1,453 @@
-import math
+import argparse
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from editbuffer import EditBuffer
+from engine import (ExpressionError, ExpressionTooLarge, IncrementalParser, apply_operator,
+                    compile_normalized, evaluate, is_assignable, referenced_names,
+                    split_assignment)
+from formatting import format_value, full_text
+from metrics import Metrics, Profiler
+from worksheet import Worksheet
+
+
+# Display symbols in pasted text and what the engine reads them as
+_PASTE_SYMBOLS = {"×": "*", "÷": "/"}
+_PASTE_RE = re.compile(r"[×÷]")
+
+# Decimal places written by batch mode for exact results that aren't whole
+BATCH_PLACES = 17
+
+
+def compute(expression, operation="=", seed=None, env=None):
+    # Evaluation without touching any backend state, so it can also run in a
+    # worker process. operation is "=", "√" or "x²". seed is (text, value)
+    # when the expression starts with a previous result shown as text, which
+    # then counts as exactly that value. env holds the variables (and ans);
+    # for "name = ..." the value is that of the right-hand side. Returns the
+    # value (None on failure), its display text ("Error" / "Too large" on
+    # failure) and the exception, None on success.
+    try:
+        env = dict(env) if env else {}
+        if seed is not None:
+            text, env["ans"] = seed
+            # The engine maps mod to % and caches the compiled expression
+            expression = "ans " + expression[len(text):]
+        _, body = split_assignment(expression)
+        value = evaluate(body, env)
+        if operation == "√":
+            value = apply_operator("√", value)
+        elif operation == "x²":
+            value = apply_operator("**", value, 2)
+        return value, format_value(value), None
+    except ExpressionTooLarge as e:
+        # Rejected up front instead of hanging
+        return None, "Too large", e
+    except Exception as e:
+        return None, "Error", e
+
+
+def timed_compute(expression, operation="=", seed=None, env=None):
+    # compute() plus what the metrics need: seconds spent and whether the
+    # compiled expression came from the parse cache
+    hits = compile_normalized.cache_info().hits
+    start = time.perf_counter()
+    value, text, error = compute(expression, operation, seed, env)
+    seconds = time.perf_counter() - start
+    return value, text, error, seconds, compile_normalized.cache_info().hits > hits
+
 
 class CalculatorBackend:
     def __init__(self):
-        self.expression = ""
+        self._parser = IncrementalParser()
+        self._buffer = EditBuffer()
+        # Text of the buffer, None until asked for again after an edit
+        self._expression = ""
+        # First character whose parser state is out of date, None if all are current
+        self._stale = None
+        # Value of the last result and the text it is shown as, while the
+        # expression still starts with that text unchanged
+        self._seed = None
+        self.ans = None
+        # Calculations and variables; the worksheet line ans came from, if any
+        self.sheet = Worksheet()
+        self._ans_line = None
+        self.last_error = None
+        self.metrics = Metrics()
+        self.profiler = Profiler()
+
+    @property
+    def expression(self):
+        if self._expression is None:
+            self._expression = self._buffer.text()
+        return self._expression
+
+    @expression.setter
+    def expression(self, value):
+        # Replacing the whole expression rebuilds the incremental parser state
+        self._buffer.replace(0, len(self._buffer), value)
+        self._expression = value
+        self._seed = None
+        self._stale = None
+        self._parser.reset(value)
+
+    @property
+    def cursor(self):
+        # Where input goes, as a character offset into the expression
+        return self._buffer.cursor
+
+    def move_cursor(self, position):
+        self._buffer.move_cursor(position)
+
+    @property
+    def seed(self):
+        # (text, value) of the result the expression starts with, for compute()
+        return self._seed
+
+    @property
+    def env(self):
+        # Variables and ans, for compute()
+        env = self.sheet.values()
+        if self.ans is not None:
+            env["ans"] = self.ans
+        return env
+
+    def unbound_names(self):
+        # Names in the expression without a value, such as the variable of
+        # an expression to plot
+        return referenced_names(self.expression) - self.env.keys()
+
+    def expects_operand(self):
+        # Whether an operand goes at the cursor rather than an operator: at
+        # the start, or after an operator or "("
+        cursor = self._buffer.cursor
+        before = self._buffer.text(max(0, cursor - 8), cursor).rstrip()
+        return not before or before[-1] in "+-*/%(√" or before.endswith("mod")
+
+    def can_assign(self):
+        # Whether the expression is a name that "=" should assign to
+        return is_assignable(self.expression)
+
+    def set_value(self, value, text):
+        # Continue from a result: text is shown, value is what gets computed
+        self._buffer.replace(0, len(self._buffer), text)
+        self._expression = text
+        self._seed = (text, value)
+        self.ans = value
+        self._stale = None
+        self._parser.reset(text, value)
+
+    def full_result(self):
+        # Every digit of the last result, which is only shown rounded or in
+        # scientific notation when it is long; None if there is no result
+        if self.ans is None:
+            return None
+        return full_text(self.ans)
+
+    def expand_result(self):
+        # Show the result the expression is, in full, keeping its exact value
+        if self._seed is None or self._seed[0] != self.expression:
+            return False
+        text = full_text(self._seed[1])
+        if text == self.expression:
+            return False
+        self.set_value(self._seed[1], text)
+        return True
+
+    def _touch(self, start, text=""):
+        # An edit at start is about to happen; returns the first character
+        # whose parser state has to be recomputed
+        if self._seed is None:
+            return start
+        length = len(self._seed[0])
+        first = text[:1]
+        if start < length or (start == length and (first.isdigit() or first == ".")):
+            # Editing the result itself (or more digits on it), it's plain
+            # text from now on; only its last parser state holds the value
+            self._seed = None
+            return min(start, length - 1)
+        return start
+
+    def _invalidate(self, start):
+        # Parser states from start on are out of date; they are recomputed
+        # when the preview is next asked for
+        self._expression = None
+        if self._stale is None or start < self._stale:
+            self._stale = start
+
+    @property
+    def preview_pending(self):
+        # Whether the parser is still catching up with an edit, see preview()
+        return self._stale is not None
+
+    def _parser_value(self, seconds=None):
+        if self._stale is not None:
+            # Keep the states before the first edit, feed the text after it again
+            self._parser.truncate(self._stale)
+            self._stale += self._parser.feed(self._buffer.text(self._stale), seconds)
+            if self._stale < len(self._buffer):
+                return None
+            self._stale = None
+        return self._parser.value()
+
+    def _edit(self, start, end, text=""):
+        # Every edit goes through the buffer, O(log n) at any position. The
+        # parser states stay current when typing or deleting at the end;
+        # after an edit anywhere else they are brought up to date lazily.
+        resync = self._touch(start, text)
+        at_end = end == len(self._buffer) and resync == start and self._stale is None
+        self._buffer.replace(start, end, text)
+        if at_end:
+            if self._expression is not None and start == end:
+                self._expression += text
+            elif self._expression is not None:
+                self._expression = self._expression[:start] + text
+            self._parser.truncate(start)
+            self._parser.feed(text)
+        else:
+            self._invalidate(resync)
+
+    def _insert(self, text):
+        cursor = self._buffer.cursor
+        self._edit(cursor, cursor, text)
 
     def input(self, char):
         if char == "π":
-            self.expression += str(math.pi)
+            self._insert("π")
         elif char == "÷":
-            self.expression += "/"
+            self._insert("/")
         elif char == "×":
-            self.expression += "*"
+            self._insert("*")
         elif char == "√":
             # For square root, we'll need to handle this specially
             if self.expression:
-                try:
-                    result = math.sqrt(float(eval(self.expression)))
-                    self.expression = str(result)
-                except:
-                    self.expression = "Error"
+                self.apply(char, *timed_compute(self.expression, char, self.seed, self.env))
             else:
-                self.expression = "√("
+                self._insert("√(")
         elif char == "x²":
-            # For square, we'll need to handle this specially
-            if self.expression:
-                try:
-                    result = float(eval(self.expression)) ** 2
-                    self.expression = str(result)
-                except:
-                    self.expression = "Error"
+            # Squares the result; in an expression of a variable with no
+            # value (one to plot), squares the operand before the cursor
+            if self.unbound_names():
+                self._insert("²")
+            elif self.expression:
+                self.apply(char, *timed_compute(self.expression, char, self.seed, self.env))
         else:
-            self.expression += str(char)
+            self._insert(str(char))
+
+    def paste(self, text, position=None):
+        # Bulk input, at the cursor or at position: a pasted or generated
+        # expression goes in as one edit, mapped to the backend's operators in
+        # a single pass. Typed at the end it is fed to the parser right away,
+        # anywhere else the parser catches up on the next preview.
+        if position is not None:
+            self._buffer.move_cursor(position)
+        text = _PASTE_RE.sub(lambda match: _PASTE_SYMBOLS[match.group()], text)
+        if text:
+            self._insert(text)
+
+    def ingest(self, chunks):
+        # paste() for text arriving in pieces, e.g. read from a file or socket
+        for chunk in chunks:
+            self.paste(chunk)
+
+    def recall(self, text):
+        # Replace the expression with one shown in history, e.g. "12×3÷4"
+        self.expression = text.replace("×", "*").replace("÷", "/")
+
+    def backspace(self):
+        # Drop the token before the cursor: a character, or a word like "mod"
+        cursor = self._buffer.cursor
+        if cursor:
+            self._edit(self._buffer.token_start(cursor), cursor)
+
+    def delete(self, start, end):
+        if start < end:
+            self._edit(start, end)
+
+    def undo(self):
+        # Edits are undone from their stored deltas; returns False if there was none
+        return self._restore(self._buffer.undo())
+
+    def redo(self):
+        return self._restore(self._buffer.redo())
+
+    def _restore(self, start):
+        if start is None:
+            return False
+        self._invalidate(self._touch(start))
+        return True
 
     def clear(self):
         self.expression = ""
 
-    def evaluate(self):
-        try:
-            # Replace mod with % for Python evaluation
-            expr = self.expression.replace("mod", "%")
-            result = str(eval(expr))
-            self.expression = result  # To allow chaining like 2+2=4+3
-            return result
-        except:
+    def preview(self, seconds=None):
+        # Live result of what has been typed so far, "" while incomplete.
+        # After an edit before the end, the parser feeds the text from there
+        # on again; with seconds it stops after about that long, and the
+        # preview is "" while preview_pending until a later call finishes.
+        value = self._parser_value(seconds)
+        if value is None:
+            return ""
+        return format_value(value)
+
+    def apply(self, operation, value, text, error=None, seconds=None, cache_hit=None):
+        # Store the outcome of timed_compute(), which may have run in another
+        # process, and return its text. A calculation goes into the worksheet;
+        # whatever depended on a variable it redefines goes stale there, for
+        # the caller to recompute the same way (see Worksheet.stale_order).
+        if error is None and operation == "=":
+            expression = self.expression
+            if self._seed is not None:
+                expression = "ans " + expression[len(self._seed[0]):]
+            try:
+                index = self.sheet.record(expression, value, text, self._ans_line, self.ans)
+            except ExpressionError as e:
+                value, text, error = None, "Error", e
+            else:
+                self._ans_line = index
+        self.metrics.record(self.expression, error, seconds, cache_hit)
+        self.last_error = error
+        if error is None:
+            if operation != "=":
+                self._ans_line = None
+            self.set_value(value, text)  # To allow chaining like 2+2=4+3
+        elif operation == "=":
             self.expression = ""
-            return "Error"
+        else:
+            self.expression = "Error"
+        return text
+
+    def evaluate(self):
+        # All in this process, including the lines a redefinition left stale
+        text = self.apply("=", *timed_compute(self.expression, "=", self.seed, self.env))
+        self.sheet.recompute()
+        return text
+
+    def stats(self, history=None):
+        # Counters and timings so far; pass the history model to include its size
+        stats = self.metrics.snapshot()
+        stats["expression_length_now"] = len(self.expression)
+        stats["profiling"] = self.profiler.active
+        if history is not None:
+            stats["history"] = {"entries": len(history), "bytes": history.size_bytes}
+        return stats
+
+
+# Headless batch evaluation, e.g. python3 backend.py --batch exprs.txt
+
+def evaluate_line(expression):
+    # Returns (result, error) where exactly one of them is None
+    try:
+        value = evaluate(expression)
+        # Floats (π, irrational roots) print as the shortest text that reads back the same
+        if type(value) is float:
+            return repr(value), None
+        # Whole numbers are written with every digit, however long
+        if type(value) is int:
+            return full_text(value), None
+        return format_value(value, BATCH_PLACES), None
+    except ExpressionError as e:
+        return None, str(e)
+
+
+def _evaluate_chunk(chunk):
+    return [(number, expression) + evaluate_line(expression) for number, expression in chunk]
+
+
+def _format_rows(rows, output_format):
+    if output_format == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for number, expression, result, error in rows:
+            writer.writerow((number, expression, result or "", error or ""))
+        return out.getvalue()
+    return "".join(
+        json.dumps({
+            "line": number,
+            "expression": expression,
+            "result": result,
+            "error": error,
+        }, ensure_ascii=False) + "\n"
+        for number, expression, result, error in rows
+    )
+
+
+def _render_chunk(task):
+    # Evaluate and format in the worker so the parent only has to write text
+    chunk, output_format = task
+    rows = _evaluate_chunk(chunk)
+    failures = sum(1 for row in rows if row[3] is not None)
+    return failures, _format_rows(rows, output_format)
+
+
+def _read_chunks(lines, chunk_size):
+    # Number the non-blank lines (1-based, as in the file) and group them
+    numbered = (
+        (number, line.strip())
+        for number, line in enumerate(lines, 1)
+        if line.strip()
+    )
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _map_ordered(func, tasks, jobs):
+    # Results come back in task order; tasks are pulled lazily from the input
+    if jobs == 1:
+        yield from map(func, tasks)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap(func, tasks)
+
+
+def evaluate_batch(lines, jobs=None, chunk_size=1000):
+    # Yields (line number, expression, result, error) in input order while
+    # the chunks are spread over a process pool
+    for rows in _map_ordered(_evaluate_chunk, _read_chunks(lines, chunk_size), jobs):
+        yield from rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate calculator expressions without a display.")
+    parser.add_argument("--batch", metavar="FILE", required=True,
+                        help="file with one expression per line, - for stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv",
+                        help="output format (default: csv)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="expressions sent to a worker at a time (default: 1000)")
+    args = parser.parse_args(argv)
+    if args.jobs < 1 or args.chunk_size < 1:
+        parser.error("--jobs and --chunk-size must be at least 1")
+
+    if args.batch == "-":
+        source = sys.stdin
+    else:
+        source = open(args.batch, encoding="utf-8")
+
+    if args.format == "csv":
+        sys.stdout.write("line,expression,result,error\r\n")
+
+    failures = 0
+    with source:
+        tasks = ((chunk, args.format) for chunk in _read_chunks(source, args.chunk_size))
+        for chunk_failures, text in _map_ordered(_render_chunk, tasks, args.jobs):
+            failures += chunk_failures
+            sys.stdout.write(text)
+    # Non-zero exit status when any expression failed
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import engine
+from backend import CalculatorBackend
+from editbuffer import text_diff
+from formatting import format_value
+from history import HistoryModel, format_history_line
+from plot import SampleGrid, compile_plot, np, resample
+from search import HistoryIndex
+
+# Headless benchmarks for the backend, formatting and history hot paths.
+#
+#   python3 bench.py --output before.json
+#   python3 bench.py --compare before.json
+#
+# Each benchmark is a setup function returning the callable to time, plus
+# the number of operations one call performs so results are per operation.
+
+BENCHMARKS = {}
+
+LONG_EXPRESSION = "+".join(f"{i}*{i % 7 + 1}" for i in range(2000))
+
+
+def benchmark(name, ops=1):
+    def register(setup):
+        BENCHMARKS[name] = (setup, ops)
+        return setup
+    return register
+
+
+@benchmark("input_append_chars", ops=1000)
+def bench_input_append():
+    text = ("12+34*5-6/7" * 100)[:1000]
+
+    def run():
+        backend = CalculatorBackend()
+        for char in text:
+            backend.input(char)
+    return run
+
+
+@benchmark("input_pi")
+def bench_input_pi():
+    backend = CalculatorBackend()
+
+    def run():
+        backend.clear()
+        backend.input("π")
+    return run
+
+
+@benchmark("evaluate_short_cold")
+def bench_evaluate_short_cold():
+    def run():
+        engine.compile_normalized.cache_clear()
+        engine.parse_normalized.cache_clear()
+        engine.evaluate("12+34*5-6/7")
+    return run
+
+
+@benchmark("evaluate_short_warm")
+def bench_evaluate_short_warm():
+    engine.evaluate("12+34*5-6/7")
+    return lambda: engine.evaluate("12+34*5-6/7")
+
+
+@benchmark("evaluate_long_cold")
+def bench_evaluate_long_cold():
+    def run():
+        engine.compile_normalized.cache_clear()
+        engine.parse_normalized.cache_clear()
+        engine.evaluate(LONG_EXPRESSION)
+    return run
+
+
+@benchmark("evaluate_long_warm")
+def bench_evaluate_long_warm():
+    engine.evaluate(LONG_EXPRESSION)
+    return lambda: engine.evaluate(LONG_EXPRESSION)
+
+
+@benchmark("backend_evaluate_chain")
+def bench_backend_evaluate_chain():
+    # = followed by more input, as in 2+2=4+3
+    backend = CalculatorBackend()
+
+    def run():
+        backend.expression = "2+2"
+        backend.evaluate()
+        backend.input("+")
+        backend.input("3")
+        backend.evaluate()
+    return run
+
+
+@benchmark("sqrt_reevaluate")
+def bench_sqrt():
+    backend = CalculatorBackend()
+
+    def run():
+        backend.expression = "12*12+7"
+        backend.input("√")
+    return run
+
+
+@benchmark("square_reevaluate")
+def bench_square():
+    backend = CalculatorBackend()
+
+    def run():
+        backend.expression = "12*12+7"
+        backend.input("x²")
+    return run
+
+
+@benchmark("backspace_pop", ops=1000)
+def bench_backspace_pop():
+    text = LONG_EXPRESSION[:1000]
+
+    def run():
+        backend = CalculatorBackend()
+        backend.input(text)
+        for _ in range(len(text)):
+            backend.backspace()
+    return run
+
+
+@benchmark("paste_long", ops=len(LONG_EXPRESSION))
+def bench_paste_long():
+    # A whole generated expression pasted at once, per character
+    text = LONG_EXPRESSION.replace("*", "×")
+
+    def run():
+        backend = CalculatorBackend()
+        backend.paste(text)
+        backend.preview()
+    return run
+
+
+@benchmark("edit_middle", ops=2)
+def bench_edit_middle():
+    # Insert and delete a character in the middle of a long expression
+    backend = CalculatorBackend()
+    backend.input(LONG_EXPRESSION)
+    middle = len(LONG_EXPRESSION) // 2
+
+    def run():
+        # With the preview the typing area shows after each key
+        backend.move_cursor(middle)
+        backend.input("5")
+        backend.preview()
+        backend.backspace()
+        backend.preview()
+    return run
+
+
+@benchmark("undo_redo", ops=2)
+def bench_undo_redo():
+    backend = CalculatorBackend()
+    backend.input(LONG_EXPRESSION)
+    backend.move_cursor(len(LONG_EXPRESSION) // 2)
+    backend.input("5")
+
+    def run():
+        backend.undo()
+        backend.preview()
+        backend.redo()
+        backend.preview()
+    return run
+
+
+@benchmark("display_diff", ops=2)
+def bench_display_diff():
+    # The span the typing area rewrites for one key at the end and one in the middle
+    shown = LONG_EXPRESSION
+    appended = shown + "5"
+    middle = len(shown) // 2
+    edited = shown[:middle] + "5" + shown[middle:]
+
+    def run():
+        text_diff(shown, appended)
+        text_diff(shown, edited)
+    return run
+
+
+@benchmark("backspace_clear_reinput", ops=200)
+def bench_backspace_reinput():
+    # The clear-and-reinput loop backspace used before it could pop parser state
+    text = LONG_EXPRESSION[:1000]
+
+    def run():
+        backend = CalculatorBackend()
+        backend.input(text)
+        for _ in range(200):
+            new_expr = backend.expression[:-1]
+            backend.clear()
+            backend.input(new_expr)
+    return run
+
+
+@benchmark("preview_long")
+def bench_preview():
+    backend = CalculatorBackend()
+    backend.input(LONG_EXPRESSION)
+    return backend.preview
+
+
+@benchmark("format_huge_int")
+def bench_format_huge_int():
+    value = 2 ** 200000
+    return lambda: format_value(value)
+
+
+@benchmark("worksheet_recompute", ops=500)
+def bench_worksheet_recompute():
+    # Redefine the first of 500 variables each defined from the one before
+    backend = CalculatorBackend()
+    backend.expression = "v0 = 1"
+    backend.evaluate()
+    for i in range(1, 500):
+        backend.expression = f"v{i} = v{i - 1} + 1"
+        backend.evaluate()
+    values = itertools.cycle(("v0 = 2", "v0 = 1"))
+
+    def run():
+        backend.expression = next(values)
+        backend.evaluate()
+    return run
+
+
+if np is not None:
+    @benchmark("plot_envelope_10m")
+    def bench_plot_envelope():
+        # Reduce 10⁷ samples to min/max pairs for 700 pixel columns
+        _, function = compile_plot("x² mod 7 - √x")
+        grid = resample(None, function, 0, 1, 700)
+        grid = SampleGrid(grid.step, 0, function(np.arange(10_000_000) * grid.step))
+        return lambda: grid.envelope(0, 10_000_000 * grid.step, 700)
+
+    @benchmark("plot_pan")
+    def bench_plot_pan():
+        # Pan by a tenth of the view: only the exposed tenth is sampled
+        _, function = compile_plot("x² mod 7 - √x")
+        grid = resample(None, function, 0, 100, 700)
+        return lambda: resample(grid, function, 10, 110, 700)
+
+
+@benchmark("history_format_line", ops=1000)
+def bench_history_format():
+    rows = [(f"{i}×{i}+{i}÷3", str(i * i + i / 3)) for i in range(1000)]
+
+    def run():
+        for expression, result in rows:
+            format_history_line(expression, result)
+    return run
+
+
+@benchmark("history_append", ops=1000)
+def bench_history_append():
+    model = HistoryModel(500)
+
+    def run():
+        for i in range(1000):
+            model.append("12×12+7", "151")
+    return run
+
+
+@benchmark("history_search_indexed", ops=4)
+def bench_history_search():
+    model = HistoryModel(100000)
+    model.extend((f"{i}×{i % 97}+{i % 13}", str(i * (i % 97) + i % 13)) for i in range(100000))
+    index = HistoryIndex(model)
+    index.update()
+
+    def run():
+        for query in ("12345", "×42+", "= 99", "7×0"):
+            index.search(query)
+    return run
+
+
+def time_benchmark(setup, ops, repeat, min_time):
+    func = setup()
+    func()  # warm up
+
+    # Calibrate so each sample runs for at least min_time seconds
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - start) / (loops * ops))
+    return {
+        "ops": ops,
+        "loops": loops,
+        "best_us": min(samples) * 1e6,
+        "median_us": statistics.median(samples) * 1e6,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names=None, repeat=5, min_time=0.05):
+    results = {}
+    for name, (setup, ops) in BENCHMARKS.items():
+        if names and not any(pattern in name for pattern in names):
+            continue
+        results[name] = time_benchmark(setup, ops, repeat, min_time)
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    # Prints a table of per-op times against a baseline, returns the regressions
+    regressions = []
+    print(f"{'benchmark':28} {'baseline us':>12} {'current us':>12} {'ratio':>7}")
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:28} {'-':>12} {result['best_us']:12.3f} {'new':>7}")
+            continue
+        ratio = result["best_us"] / old["best_us"] if old["best_us"] else float("inf")
+        flag = "  <-- slower" if ratio > threshold else ""
+        print(f"{name:28} {old['best_us']:12.3f} {result['best_us']:12.3f} {ratio:7.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the calculator benchmarks.")
+    parser.add_argument("names", nargs="*", help="only run benchmarks whose name contains one of these")
+    parser.add_argument("--output", metavar="FILE", help="write results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare against results from an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="ratio above which a benchmark counts as a regression (default: 1.2)")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per benchmark (default: 5)")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="minimum seconds per sample (default: 0.05)")
+    parser.add_argument("--list", action="store_true", help="list benchmark names and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    current = run_benchmarks(args.names, args.repeat, args.min_time)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 1 if compare(current, baseline, args.threshold) else 0
+
+    for name, result in current["results"].items():
+        print(f"{name:28} {result['best_us']:12.3f} us/op  (median {result['median_us']:.3f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
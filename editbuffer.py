@@ -0,0 +1,304 @@
+import random
+import re
+
+# Longest piece of text held by one node when a whole string is inserted
+PIECE_SIZE = 64
+
+# Backspace removes a whole word such as "mod", otherwise one character
+_WORD_END_RE = re.compile(r"[A-Za-z_]+$")
+
+# Most edits kept for undo
+MAX_UNDO = 1000
+
+# Characters whose consecutive inserts (or deletes) undo as one step
+_RUN_CHARS = frozenset("0123456789.")
+
+
+class _Node:
+    # One piece of the rope; size is the character count of its subtree
+    __slots__ = ("text", "priority", "left", "right", "size")
+
+    def __init__(self, text, priority=None):
+        self.text = text
+        self.priority = random.random() if priority is None else priority
+        self.left = None
+        self.right = None
+        self.size = len(text)
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = len(node.text) + _size(node.left) + _size(node.right)
+    return node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _append(root, node):
+    # _merge(root, node) for a single node, without recursion: it goes on
+    # the right spine above the first node with a lower priority
+    path = []
+    current = root
+    while current is not None and current.priority > node.priority:
+        path.append(current)
+        current = current.right
+    node.left = current
+    _update(node)
+    if not path:
+        return node
+    path[-1].right = node
+    for parent in path:
+        parent.size += len(node.text)
+    return root
+
+
+def _pop(root, count):
+    # Removes the last count characters when they all sit in the last piece,
+    # without recursion; returns (root, removed text) or None
+    path = []
+    node = root
+    while node.right is not None:
+        path.append(node)
+        node = node.right
+    if count > len(node.text):
+        return None
+    removed = node.text[len(node.text) - count:]
+    for parent in path:
+        parent.size -= count
+    if count < len(node.text):
+        node.text = node.text[:-count]
+        node.size -= count
+    elif path:
+        path[-1].right = node.left
+    else:
+        root = node.left
+    return root, removed
+
+
+def _split(node, position):
+    # (first position characters, the rest); a piece straddling the
+    # position is cut in two
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if position <= left_size:
+        first, node.left = _split(node.left, position)
+        return first, _update(node)
+    position -= left_size
+    if position >= len(node.text):
+        node.right, rest = _split(node.right, position - len(node.text))
+        return _update(node), rest
+    # Same priority keeps the heap order on both sides
+    tail = _Node(node.text[position:], node.priority)
+    tail.right = node.right
+    node.text = node.text[:position]
+    node.right = None
+    return _update(node), _update(tail)
+
+
+def _build(text):
+    # Treap of text cut into pieces, in O(n): a Cartesian tree built with a
+    # stack holding its right spine
+    if len(text) <= PIECE_SIZE:
+        return _Node(text) if text else None
+    spine = []
+    for start in range(0, len(text), PIECE_SIZE):
+        node = _Node(text[start:start + PIECE_SIZE])
+        last = None
+        while spine and spine[-1].priority < node.priority:
+            last = _update(spine.pop())
+        node.left = last
+        if spine:
+            spine[-1].right = node
+        spine.append(node)
+    while len(spine) > 1:
+        _update(spine.pop())
+    return _update(spine[0]) if spine else None
+
+
+def _pieces(node, start=0):
+    # Piece texts in order, from character start on
+    stack = []
+    while True:
+        # Only go left while the wanted text starts in the left subtree
+        while node is not None:
+            left_size = _size(node.left)
+            stack.append((node, start - left_size))
+            node = node.left if start < left_size else None
+        if not stack:
+            return
+        node, offset = stack.pop()
+        if offset < len(node.text):
+            yield node.text[max(0, offset):]
+        start = max(0, offset - len(node.text))
+        node = node.right
+
+
+def _is_run(text):
+    return bool(text) and _RUN_CHARS.issuperset(text)
+
+
+class EditBuffer:
+    # Expression text as a rope (an implicit treap of text pieces ordered by
+    # position), with a cursor. Inserting or deleting anywhere is O(log n)
+    # plus the size of the edit. Undo and redo keep each edit as a delta
+    # (position, removed text, inserted text) rather than a copy of the text;
+    # a run of typed digits undoes in one step.
+
+    def __init__(self, text=""):
+        self._root = _build(text)
+        self.cursor = len(text)
+        self._undo = []
+        self._redo = []
+
+    def __len__(self):
+        return _size(self._root)
+
+    def text(self, start=0, end=None):
+        if end is None:
+            return "".join(_pieces(self._root, start))
+        parts = []
+        remaining = end - start
+        for piece in _pieces(self._root, start):
+            if remaining <= 0:
+                break
+            parts.append(piece[:remaining])
+            remaining -= len(piece)
+        return "".join(parts)
+
+    def move_cursor(self, position):
+        self.cursor = min(max(position, 0), len(self))
+
+    def char_before(self, position):
+        # The character before position, "" at the start
+        node = self._root
+        position -= 1
+        if position < 0:
+            return ""
+        while node is not None:
+            left_size = _size(node.left)
+            if position < left_size:
+                node = node.left
+            elif position < left_size + len(node.text):
+                return node.text[position - left_size]
+            else:
+                position -= left_size + len(node.text)
+                node = node.right
+        return ""
+
+    def token_start(self, position):
+        # Where the token ending at position starts: a word ("mod") or one character
+        if not _WORD_END_RE.match(self.char_before(position)):
+            return max(0, position - 1)
+        start = max(0, position - PIECE_SIZE)
+        return start + _WORD_END_RE.search(self.text(start, position)).start()
+
+    def _replace(self, start, end, text):
+        size = _size(self._root)
+        if start == end == size:
+            # Typing at the end, no need to split
+            if len(text) == 1:
+                self._root = _append(self._root, _Node(text))
+            else:
+                self._root = _merge(self._root, _build(text))
+            return ""
+        if end == size and not text:
+            # Backspace at the end
+            popped = _pop(self._root, end - start)
+            if popped is not None:
+                self._root, removed = popped
+                return removed
+        first, rest = _split(self._root, start)
+        removed, rest = _split(rest, end - start)
+        self._root = _merge(_merge(first, _build(text)), rest)
+        return "".join(_pieces(removed))
+
+    def replace(self, start, end, text):
+        # Replace characters start to end with text and record it for undo
+        if start == end and not text:
+            return ""
+        removed = self._replace(start, end, text)
+        self.cursor = start + len(text)
+        self._redo.clear()
+        if self._undo:
+            last_start, last_removed, last_inserted = self._undo[-1]
+            if (not removed and not last_removed and _is_run(text) and _is_run(last_inserted)
+                    and start == last_start + len(last_inserted)):
+                self._undo[-1] = (last_start, "", last_inserted + text)
+                return removed
+            if (not text and not last_inserted and _is_run(removed) and _is_run(last_removed)
+                    and end == last_start):
+                self._undo[-1] = (start, removed + last_removed, "")
+                return removed
+        self._undo.append((start, removed, text))
+        if len(self._undo) > MAX_UNDO:
+            del self._undo[0]
+        return removed
+
+    def _swap(self, source, target):
+        if not source:
+            return None
+        start, removed, inserted = source.pop()
+        self._replace(start, start + len(inserted), removed)
+        target.append((start, inserted, removed))
+        self.cursor = start + len(removed)
+        return start
+
+    def undo(self):
+        # Reverts the last edit, returns where it started (None if nothing to undo)
+        return self._swap(self._undo, self._redo)
+
+    def redo(self):
+        return self._swap(self._redo, self._undo)
+
+
+# Characters compared at a time when looking for where two texts differ
+_DIFF_CHUNK = 256
+
+
+def _common_prefix(old, new, limit):
+    # Chunks are compared at C speed, then characters up to the first difference
+    length = 0
+    while length < limit:
+        size = min(_DIFF_CHUNK, limit - length)
+        if old[length:length + size] != new[length:length + size]:
+            break
+        length += size
+    while length < limit and old[length] == new[length]:
+        length += 1
+    return length
+
+
+def _common_suffix(old, new, limit):
+    length = 0
+    old_end, new_end = len(old), len(new)
+    while length < limit:
+        size = min(_DIFF_CHUNK, limit - length)
+        if old[old_end - length - size:old_end - length] != new[new_end - length - size:new_end - length]:
+            break
+        length += size
+    while length < limit and old[old_end - length - 1] == new[new_end - length - 1]:
+        length += 1
+    return length
+
+
+def text_diff(old, new):
+    # The single edit turning old into new: (start, end, text) with
+    # old[:start] + text + old[end:] == new. Typing at the end is
+    # (len(old), len(old), typed), a backspace (len(new), len(old), "").
+    start = _common_prefix(old, new, min(len(old), len(new)))
+    kept = _common_suffix(old, new, min(len(old), len(new)) - start)
+    return start, len(old) - kept, new[start:len(new) - kept]
@@ -0,0 +1,895 @@
+import math
+import operator
+import re
+import time
+from fractions import Fraction
+from functools import lru_cache
+
+# Number of compiled expressions kept around for repeated / chained evaluations
+CACHE_SIZE = 1024
+
+
+# Evaluation budgets: largest integer result (in bits) and CPU time per evaluation
+DEFAULT_MAX_BITS = 1 << 20
+DEFAULT_MAX_SECONDS = 2.0
+
+# CPU time the live preview may spend per update, within a frame; anything
+# that would take longer has no preview
+PREVIEW_SECONDS = 0.01
+
+_SECONDS_PER_DIGIT_WORK = 3e-9
+
+# Characters fed between clock reads when feeding is time-sliced
+_CLOCK_STRIDE = 256
+
+# Longer digit strings are converted in halves: int() refuses strings over
+# 4300 digits, and is quadratic in their length anyway
+_DIRECT_DIGITS = 4000
+
+
+class ExpressionError(Exception):
+    # kind says what went wrong: "syntax", "name", "too_large" or the name of
+    # the arithmetic error raised while evaluating (e.g. "ZeroDivisionError")
+
+    def __init__(self, message, kind="syntax"):
+        super().__init__(message)
+        self.kind = kind
+
+    def __reduce__(self):
+        # Keep kind when sent back from a worker process
+        return type(self), (str(self), self.kind)
+
+
+class ExpressionTooLarge(ExpressionError):
+    # Raised before an operation that would blow the budget is attempted.
+    # resource is "bits" (result size) or "seconds" (CPU time).
+
+    def __init__(self, resource, estimate, limit):
+        self.resource = resource
+        self.estimate = estimate
+        self.limit = limit
+        super().__init__(f"result too large: about {estimate} {resource}, limit is {limit}", "too_large")
+
+    def __reduce__(self):
+        # Keep the structured fields when sent back from a worker process
+        return type(self), (self.resource, self.estimate, self.limit)
+
+
+class Limits:
+    def __init__(self, max_bits=DEFAULT_MAX_BITS, max_seconds=DEFAULT_MAX_SECONDS):
+        self.max_bits = max_bits
+        self.max_seconds = max_seconds
+        self.started = None
+        self.seconds = max_seconds
+
+    def start(self, seconds=None):
+        # The CPU time budget runs from now: max_seconds, or seconds if given
+        self.seconds = self.max_seconds if seconds is None else seconds
+        self.started = time.process_time()
+
+    def stop(self):
+        self.started = None
+
+    def check(self, bits):
+        # bits is the estimated size of the next integer result
+        if bits > self.max_bits:
+            raise ExpressionTooLarge("bits", bits, self.max_bits)
+        if self.started is not None:
+            # Karatsuba multiplication: about 3ns per (30-bit digit)^1.585
+            work = _SECONDS_PER_DIGIT_WORK * (bits / 30) ** 1.585
+            spent = time.process_time() - self.started
+            if spent + work > self.seconds:
+                raise ExpressionTooLarge("seconds", round(spent + work, 3), self.seconds)
+
+
+# Budgets applied to every evaluation, adjust with configure_limits()
+limits = Limits()
+
+
+def configure_limits(max_bits=None, max_seconds=None):
+    if max_bits is not None:
+        limits.max_bits = max_bits
+    if max_seconds is not None:
+        limits.max_seconds = max_seconds
+
+
+# Numbers, names, operators and the display symbols the UI may hand us directly
+_TOKEN_RE = re.compile(
+    r"(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)"
+    r"|([A-Za-z_][A-Za-z0-9_]*)"
+    r"|(\*\*|//|[-+*/%()√π²])"
+    r"|(\S)"
+)
+
+# "mod" is an operator unless it is part of a longer name
+_MOD_RE = re.compile(r"(?<![A-Za-z_])mod(?![A-Za-z_])")
+
+# "name = expression" defines a variable
+_ASSIGNMENT_RE = re.compile(r"\s*([A-Za-z_][A-Za-z0-9_]*)\s*=(.*)", re.S)
+_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Names that can't be assigned: the previous result and the operator
+RESERVED_NAMES = frozenset({"ans", "mod"})
+
+
+# Numbers are exact while they can be: ints, and Fractions for decimals and
+# quotients. Floats only come in through π and irrational results (√2, 2**0.5),
+# and anything combined with a float is a float.
+
+def _exact(value):
+    # Whole Fractions become ints again
+    if type(value) is Fraction and value.denominator == 1:
+        return value.numerator
+    return value
+
+
+def _bits(value):
+    # Size of an exact number, 0 for floats
+    if type(value) is int:
+        return value.bit_length()
+    if type(value) is Fraction:
+        return value.numerator.bit_length() + value.denominator.bit_length()
+    return 0
+
+
+def _digits_to_int(digits):
+    if len(digits) <= _DIRECT_DIGITS:
+        return int(digits)
+    low = len(digits) // 2
+    return _digits_to_int(digits[:-low]) * 10 ** low + _digits_to_int(digits[-low:])
+
+
+def _number(text):
+    # Literal as an int, or an exact Fraction for decimals and exponents
+    # ("0.1" is 1/10, not the nearest float). An exponent too large for the
+    # bit budget falls back to a float (inf or 0.0, as before).
+    if len(text) <= _DIRECT_DIGITS:
+        if text.isdigit():
+            return int(text)
+        mantissa, _, exponent = text.lower().partition("e")
+        if exponent and abs(int(exponent)) * 3.33 + len(mantissa) * 3.33 > limits.max_bits:
+            return float(text)
+        return _exact(Fraction(text))
+
+    # A long literal, such as a result shown in full and then edited
+    mantissa, _, exponent = text.lower().partition("e")
+    whole, _, decimals = mantissa.partition(".")
+    exponent = int(exponent or 0) - len(decimals)
+    if abs(exponent) * 3.33 + len(mantissa) * 3.33 > limits.max_bits and (
+            exponent < 0 or len(mantissa) * 3.33 <= limits.max_bits):
+        return float(text)
+    # Converting the digits costs about as much as multiplying numbers that
+    # size, and is held to the same budget
+    limits.check(round(len(mantissa) * 3.33))
+    value = _digits_to_int(whole + decimals)
+    if exponent < 0:
+        return _exact(Fraction(value, 10 ** -exponent))
+    return value * 10 ** exponent
+
+
+def _sqrt(value):
+    # Exact for perfect squares of ints and Fractions (√(9/4) is 3/2)
+    if type(value) in (int, Fraction) and value >= 0:
+        numerator, denominator = value.numerator, value.denominator
+        root_n, root_d = math.isqrt(numerator), math.isqrt(denominator)
+        if root_n * root_n == numerator and root_d * root_d == denominator:
+            return _exact(Fraction(root_n, root_d))
+    return math.sqrt(float(value))
+
+
+# Exact results grow without bound, so their size is estimated from the
+# operands' bit lengths before the work is done. Everything else either
+# stays small or fails fast on its own (float overflow, int to float...).
+
+def _log2(value):
+    # log2 of the numerator plus log2 of the denominator: bits per power
+    if type(value) is int:
+        return math.log2(abs(value))
+    return math.log2(abs(value.numerator)) + math.log2(value.denominator)
+
+
+def _pow(base, exponent):
+    if type(exponent) is Fraction and exponent.denominator == 1:
+        exponent = exponent.numerator
+    if type(base) in (int, Fraction) and type(exponent) is int:
+        if exponent and base not in (0, 1, -1):
+            # Every power adds at least a bit, so an exponent past the limit
+            # is rejected on its own, before the estimate overflows a float
+            if abs(exponent) > limits.max_bits:
+                estimate = abs(exponent) if exponent.bit_length() <= 64 else math.inf
+                raise ExpressionTooLarge("bits", estimate, limits.max_bits)
+            limits.check(math.ceil(_log2(base) * abs(exponent)) + 1)
+        if exponent < 0:
+            # Stay exact instead of int ** -n turning into a float
+            return _exact(Fraction(base) ** exponent)
+        return _exact(base ** exponent)
+    if type(exponent) is Fraction:
+        exponent = float(exponent)
+    return base ** exponent
+
+
+def _mul(left, right):
+    if type(left) is int and type(right) is int:
+        bits = left.bit_length() + right.bit_length()
+        if bits > 64:
+            limits.check(bits)
+        return left * right
+    bits = _bits(left) + _bits(right)
+    if bits > 64:
+        limits.check(bits)
+    return _exact(left * right)
+
+
+def _fraction_sum_bits(left, right):
+    # Numerator and denominator of a/b + c/d are at most ad + cb and bd
+    left, right = Fraction(left), Fraction(right)
+    left_n, left_d = abs(left.numerator).bit_length(), left.denominator.bit_length()
+    right_n, right_d = abs(right.numerator).bit_length(), right.denominator.bit_length()
+    return max(left_n + right_d, right_n + left_d) + 1 + left_d + right_d
+
+
+def _add(left, right):
+    # Sums of ints only grow by a bit, sums of Fractions can double in size
+    if type(left) is int and type(right) is int:
+        return left + right
+    if type(left) in (int, Fraction) and type(right) in (int, Fraction):
+        bits = _fraction_sum_bits(left, right)
+        if bits > 64:
+            limits.check(bits)
+        return _exact(left + right)
+    return left + right
+
+
+def _sub(left, right):
+    if type(left) is int and type(right) is int:
+        return left - right
+    if type(left) in (int, Fraction) and type(right) in (int, Fraction):
+        bits = _fraction_sum_bits(left, right)
+        if bits > 64:
+            limits.check(bits)
+        return _exact(left - right)
+    return left - right
+
+
+def _floordiv(left, right):
+    # Whole quotients of ints are no bigger than their operands
+    if type(left) is Fraction or type(right) is Fraction:
+        bits = _bits(left) + _bits(right)
+        if bits > 64:
+            limits.check(bits)
+    return left // right
+
+
+def _mod(left, right):
+    if type(left) is Fraction or type(right) is Fraction:
+        bits = _bits(left) + _bits(right)
+        if bits > 64:
+            limits.check(bits)
+        return _exact(left % right)
+    return left % right
+
+
+def _truediv(left, right):
+    if type(left) in (int, Fraction) and type(right) in (int, Fraction):
+        if right == 0:
+            raise ZeroDivisionError("division by zero")
+        bits = _bits(left) + _bits(right)
+        if bits > 64:
+            limits.check(bits)
+        return _exact(Fraction(left, right))
+    return left / right
+
+
+# Scalar implementation of every operator in the AST, plus "const" for the
+# literals. Other backends (such as the NumPy sweep) compile the same AST
+# with their own table.
+OPERATIONS = {
+    "const": lambda value: value,
+    "+": _add,
+    "-": _sub,
+    "*": _mul,
+    "/": _truediv,
+    "//": _floordiv,
+    "%": _mod,
+    "**": _pow,
+    "pos": operator.pos,
+    "neg": operator.neg,
+    "√": _sqrt,
+}
+
+_ADDITIVE = ("+", "-")
+_MULTIPLICATIVE = ("*", "/", "//", "%")
+_PREFIX_NAMES = {"+": "pos", "-": "neg", "√": "√"}
+
+
+def normalize(expression):
+    # Map display symbols onto the operators the parser understands
+    return (
+        _MOD_RE.sub("%", expression)
+        .replace("×", "*")
+        .replace("÷", "/")
+        .strip()
+    )
+
+
+def split_assignment(expression):
+    # (name, body) for "rate = 0.07", (None, expression) for anything else
+    match = _ASSIGNMENT_RE.fullmatch(expression)
+    if match is None:
+        return None, expression
+    name, body = match.groups()
+    if name in RESERVED_NAMES:
+        raise ExpressionError(f"can't assign to {name!r}")
+    return name, body
+
+
+def is_assignable(text):
+    # Whether text is a name that "=" would start assigning to
+    text = text.strip()
+    return bool(_NAME_RE.fullmatch(text)) and text not in RESERVED_NAMES
+
+
+def referenced_names(expression):
+    # Names an expression mentions, even an incomplete one ("x² - 2")
+    return {match.group(2) for match in _TOKEN_RE.finditer(normalize(expression)) if match.group(2)}
+
+
+def tokenize(expression):
+    tokens = []
+    for match in _TOKEN_RE.finditer(expression):
+        number, name, op, bad = match.groups()
+        if number is not None:
+            tokens.append(("num", _number(number)))
+        elif name is not None:
+            tokens.append(("name", name))
+        elif op is not None:
+            if op == "π":
+                tokens.append(("num", math.pi))
+            else:
+                tokens.append(("op", op))
+        else:
+            raise ExpressionError(f"unexpected character {bad!r}")
+    return tokens
+
+
+class _Parser:
+    # Recursive descent with Python's precedence rules:
+    #   expr    := term (('+' | '-') term)*
+    #   term    := factor (('*' | '/' | '//' | '%') factor | factor)*
+    #   factor  := ('+' | '-' | '√') factor | power
+    #   power   := postfix ['**' factor]
+    #   postfix := atom '²'*
+    #   atom    := number | name | '(' expr ')'
+    # A factor directly followed by a name is an implicit multiplication
+    # ("3x"). Left-associative runs are kept flat as ("chain", first, rest)
+    # so very long sums don't turn into very deep trees.
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("empty expression")
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise ExpressionError(f"unexpected {self.peek()[1]!r}")
+        return node
+
+    def chain(self, operand, operators, implicit=None):
+        first = operand()
+        rest = []
+        while True:
+            kind, value = self.peek()
+            if kind == "op" and value in operators:
+                self.pos += 1
+                rest.append((value, operand()))
+            elif kind == "name" and implicit:
+                rest.append((implicit, operand()))
+            else:
+                break
+        if not rest:
+            return first
+        return ("chain", first, tuple(rest))
+
+    def expr(self):
+        return self.chain(self.term, _ADDITIVE)
+
+    def term(self):
+        return self.chain(self.factor, _MULTIPLICATIVE, implicit="*")
+
+    def factor(self):
+        kind, value = self.peek()
+        if kind == "op" and value in _PREFIX_NAMES:
+            self.pos += 1
+            return ("unary", _PREFIX_NAMES[value], self.factor())
+        return self.power()
+
+    def power(self):
+        base = self.postfix()
+        kind, value = self.peek()
+        if kind == "op" and value == "**":
+            self.pos += 1
+            return ("binary", "**", base, self.factor())
+        return base
+
+    def postfix(self):
+        node = self.atom()
+        while self.peek() == ("op", "²"):
+            self.pos += 1
+            node = ("binary", "**", node, ("const", 2))
+        return node
+
+    def atom(self):
+        kind, value = self.peek()
+        if kind == "num":
+            self.pos += 1
+            return ("const", value)
+        if kind == "name":
+            self.pos += 1
+            return ("name", value)
+        if kind == "op" and value == "(":
+            self.pos += 1
+            node = self.expr()
+            if self.peek() != ("op", ")"):
+                raise ExpressionError("missing ')'")
+            self.pos += 1
+            return node
+        if kind is None:
+            raise ExpressionError("unexpected end of expression")
+        raise ExpressionError(f"unexpected {value!r}")
+
+
+def free_names(node):
+    # Names (variables) an expression tree refers to
+    kind = node[0]
+    if kind == "name":
+        return {node[1]}
+    if kind == "unary":
+        return free_names(node[2])
+    if kind == "binary":
+        return free_names(node[2]) | free_names(node[3])
+    if kind == "chain":
+        names = free_names(node[1])
+        for _, operand in node[2]:
+            names |= free_names(operand)
+        return names
+    return set()
+
+
+def _constant(value):
+    return lambda env: value
+
+
+def _variable(name):
+    def lookup(env):
+        try:
+            return env[name]
+        except KeyError:
+            raise ExpressionError(f"unknown name {name!r}", "name") from None
+    return lookup
+
+
+def _try_fold(func, *args):
+    # Fold constant operands at compile time; if the operation itself fails
+    # (division by zero, math domain...) leave it to raise at evaluation time
+    try:
+        return True, func(*args)
+    except (ArithmeticError, ValueError, TypeError):
+        return False, None
+
+
+def _compile(node, operations):
+    # Returns (True, value) for constant subtrees, otherwise (False, closure)
+    # where closure(env) evaluates the subtree with names looked up in env
+    kind = node[0]
+    if kind == "const":
+        return True, operations["const"](node[1])
+
+    if kind == "name":
+        return False, _variable(node[1])
+
+    if kind == "unary":
+        func = operations[node[1]]
+        const, operand = _compile(node[2], operations)
+        if const:
+            folded, value = _try_fold(func, operand)
+            if folded:
+                return True, value
+            operand = _constant(operand)
+        return False, lambda env: func(operand(env))
+
+    if kind == "binary":
+        func = operations[node[1]]
+        left_const, left = _compile(node[2], operations)
+        right_const, right = _compile(node[3], operations)
+        if left_const and right_const:
+            folded, value = _try_fold(func, left, right)
+            if folded:
+                return True, value
+        if left_const:
+            left = _constant(left)
+        if right_const:
+            right = _constant(right)
+        return False, lambda env: func(left(env), right(env))
+
+    # chain: fold the leading run of constant operands, keep the rest as steps
+    const, first = _compile(node[1], operations)
+    steps = []
+    for symbol, operand in node[2]:
+        func = operations[symbol]
+        operand_const, operand = _compile(operand, operations)
+        if const and operand_const and not steps:
+            folded, value = _try_fold(func, first, operand)
+            if folded:
+                first = value
+                continue
+        if operand_const:
+            operand = _constant(operand)
+        steps.append((func, operand))
+    if not steps:
+        return True, first
+    if const:
+        first = _constant(first)
+    steps = tuple(steps)
+
+    def run(env):
+        value = first(env)
+        for func, operand in steps:
+            value = func(value, operand(env))
+        return value
+
+    return False, run
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_normalized(expression):
+    try:
+        return _Parser(tokenize(expression)).parse()
+    except RecursionError:
+        raise ExpressionError("expression is nested too deeply") from None
+
+
+def compile_tree(tree, operations=OPERATIONS):
+    try:
+        const, compiled = _compile(tree, operations)
+    except RecursionError:
+        raise ExpressionError("expression is nested too deeply") from None
+    if const:
+        return _constant(compiled)
+    return compiled
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_normalized(expression):
+    return compile_tree(parse_normalized(expression))
+
+
+def parse_expression(expression):
+    return parse_normalized(normalize(expression))
+
+
+def compile_expression(expression):
+    return compile_normalized(normalize(expression))
+
+
+def _guarded(func, *args):
+    # Run under the evaluation budget, arithmetic errors become ExpressionError
+    limits.start()
+    try:
+        return func(*args)
+    except (ArithmeticError, ValueError, TypeError) as e:
+        raise ExpressionError(str(e), type(e).__name__) from e
+    finally:
+        limits.stop()
+
+
+def _evaluate(expression, env):
+    # Compiling folds constants, so the budget covers it as well
+    return compile_expression(expression)(env if env is not None else {})
+
+
+def evaluate(expression, env=None):
+    return _guarded(_evaluate, expression, env)
+
+
+def apply_operator(symbol, *operands):
+    # One operator from OPERATIONS applied to values, e.g. ("√", 2)
+    return _guarded(OPERATIONS[symbol], *operands)
+
+
+# Incremental parsing for live previews.
+#
+# Every character appended to an expression produces a new immutable parser
+# state derived from the previous one, so appending is O(1) (amortized) and
+# backspace simply drops the newest state. A number being typed is not copied
+# into its states: they hold where it starts and its shape, and the digits
+# are read from the text once the number is complete, so a long literal
+# costs one shared state rather than one copy of it per digit. Operators are reduced as soon as
+# precedence allows, which keeps the operand/operator stacks as small as the
+# nesting depth rather than the expression length. Precedence follows the
+# parser above: binary +- (1), */ // % (2), prefix + - √ (3), ** (4, right
+# associative).
+
+_PREFIX_PRECEDENCE = 3
+_POWER_PRECEDENCE = 4
+_BINARY = {
+    "+": (1, OPERATIONS["+"]),
+    "-": (1, OPERATIONS["-"]),
+    "*": (2, OPERATIONS["*"]),
+    "/": (2, OPERATIONS["/"]),
+    "//": (2, OPERATIONS["//"]),
+    "%": (2, OPERATIONS["%"]),
+    "**": (_POWER_PRECEDENCE, OPERATIONS["**"]),
+}
+_PREFIX = {symbol: OPERATIONS[name] for symbol, name in _PREFIX_NAMES.items()}
+_ALIASES = {"×": "*", "÷": "/"}
+_NUMBER_RE = re.compile(r"\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?")
+# ASCII only: str.isdigit() is also true for "²"
+_DIGITS = frozenset("0123456789")
+
+
+class _State:
+    # parents:   stacked (operands, operators) of enclosing parentheses
+    # operands:  cons list (value, rest) for the innermost parentheses
+    # operators: cons list ((precedence, func, arity), rest)
+    # pending:   a token still being typed ("*", "mo", ...); for a number,
+    #            its shape: the number with each run of digits as one "0"
+    #            ("12.5e-30" is "0.0e-0")
+    # start:     offset in the text where a pending number starts
+    __slots__ = ("parents", "operands", "operators", "pending", "start", "expect", "error")
+
+    def __init__(self, parents, operands, operators, pending, expect, error=False, start=0):
+        self.parents = parents
+        self.operands = operands
+        self.operators = operators
+        self.pending = pending
+        self.start = start
+        self.expect = expect
+        self.error = error
+
+
+_INITIAL = _State(None, None, None, "", True)
+_ERROR = _State(None, None, None, "", False, True)
+
+
+def _extends_number(text, char):
+    # text is the shape of the number so far
+    if char in _DIGITS:
+        return True
+    if char == ".":
+        return "." not in text and "e" not in text.lower()
+    if char in "eE":
+        return "e" not in text.lower() and any(c.isdigit() for c in text)
+    if char in "+-":
+        return text[-1] in "eE"
+    return False
+
+
+def _reduce(operands, operators):
+    (_, func, arity), operators = operators
+    right, operands = operands
+    try:
+        if arity == 1:
+            value = func(right)
+        else:
+            left, operands = operands
+            value = func(left, right)
+    except (ArithmeticError, ValueError, TypeError, ExpressionError):
+        return None
+    return (value, operands), operators
+
+
+def _push_binary(state, op):
+    precedence, func = _BINARY[op]
+    operands, operators = state.operands, state.operators
+    while operators is not None:
+        top = operators[0][0]
+        if top < precedence or (top == precedence and precedence == _POWER_PRECEDENCE):
+            break
+        reduced = _reduce(operands, operators)
+        if reduced is None:
+            return _ERROR
+        operands, operators = reduced
+    operators = ((precedence, func, 2), operators)
+    return _State(state.parents, operands, operators, "", True)
+
+
+def _push_operand(state, value):
+    return _State(state.parents, (value, state.operands), state.operators, "", False)
+
+
+def _close(operands, operators):
+    # Reduce everything inside the innermost parentheses to a single value
+    while operators is not None:
+        reduced = _reduce(operands, operators)
+        if reduced is None:
+            return None
+        operands, operators = reduced
+    return operands[0]
+
+
+def _flush(state, chars, end):
+    # Complete the pending token, which ends at offset end of chars
+    pending = state.pending
+    if not pending:
+        return state
+    if pending == "*" or pending == "/":
+        return _push_binary(state, pending)
+    if _NUMBER_RE.fullmatch(pending):
+        try:
+            value = _number("".join(chars[state.start:end]))
+        except (ValueError, ExpressionError):
+            # Over the bit budget
+            return _ERROR
+        return _push_operand(state, value)
+    # An unfinished "mod" or a malformed number
+    return _ERROR
+
+
+def _feed(state, char, chars, position):
+    # State after char, the character at offset position of chars
+    char = _ALIASES.get(char, char)
+    pending = state.pending
+    if pending:
+        if pending[0] == "0" or pending[0] == ".":
+            if _extends_number(pending, char):
+                if char in _DIGITS:
+                    if pending[-1] == "0":
+                        # Another digit of the same run: same shape, same state
+                        return state
+                    char = "0"
+                return _State(state.parents, state.operands, state.operators,
+                              pending + char, True, start=state.start)
+        elif pending == char and char in "*/":
+            return _push_binary(state, char * 2)
+        elif pending in ("m", "mo") and char == "mod"[len(pending)]:
+            if pending == "mo":
+                return _push_binary(state, "%")
+            return _State(state.parents, state.operands, state.operators,
+                          pending + char, False)
+        state = _flush(state, chars, position)
+        if state.error:
+            return state
+
+    if char.isspace():
+        return state
+    if char in _DIGITS or char == ".":
+        if not state.expect:
+            return _ERROR
+        return _State(state.parents, state.operands, state.operators,
+                      "." if char == "." else "0", True, start=position)
+    if char == "π":
+        if not state.expect:
+            return _ERROR
+        return _push_operand(state, math.pi)
+    if char == "(":
+        if not state.expect:
+            return _ERROR
+        parents = ((state.operands, state.operators), state.parents)
+        return _State(parents, None, None, "", True)
+    if char == ")":
+        if state.expect or state.parents is None:
+            return _ERROR
+        value = _close(state.operands, state.operators)
+        if value is None:
+            return _ERROR
+        (operands, operators), parents = state.parents
+        return _State(parents, (value, operands), operators, "", False)
+    if state.expect:
+        if char in _PREFIX:
+            operators = ((_PREFIX_PRECEDENCE, _PREFIX[char], 1), state.operators)
+            return _State(state.parents, state.operands, operators, "", True)
+        return _ERROR
+    if char in "*/m":
+        return _State(state.parents, state.operands, state.operators, char, False)
+    if char in "+-%":
+        return _push_binary(state, char)
+    if char == "²":
+        # Postfix, binds to the operand just completed
+        value, operands = state.operands
+        try:
+            value = OPERATIONS["**"](value, 2)
+        except (ArithmeticError, ValueError, TypeError, ExpressionError):
+            return _ERROR
+        return _State(state.parents, (value, operands), state.operators, "", False)
+    return _ERROR
+
+
+class IncrementalParser:
+    # Keeps one parser state per character of the expression fed to it, and
+    # the characters themselves
+
+    def __init__(self, text=""):
+        self.states = [_INITIAL]
+        self.chars = []
+        # Index of the first state reset() left out, None if there are none
+        self._unfed = None
+        self.feed(text)
+
+    def reset(self, text="", value=None):
+        # With a value, text is how that value was displayed (a previous
+        # result) and stands for exactly that value rather than its digits.
+        # Only the last state is needed then: the ones before it are None
+        # until an edit inside the text needs them, so a result shown with
+        # all its digits costs no parsing.
+        self.states = [_INITIAL]
+        self.chars = []
+        self._unfed = None
+        if value is None or not text:
+            self.feed(text)
+            return
+        self.chars.extend(text)
+        if len(text) > 1:
+            self.states.extend([None] * (len(text) - 1))
+            self._unfed = 1
+        self.states.append(_push_operand(_INITIAL, value))
+
+    def _refeed(self):
+        # Work out the states reset() left out once one of them is the newest
+        states = self.states
+        if self._unfed is not None and len(states) <= self._unfed:
+            self._unfed = None
+        if states[-1] is not None:
+            return
+        start = self._unfed
+        text = self.chars[start - 1:len(states) - 1]
+        del states[start:]
+        del self.chars[start - 1:]
+        self._unfed = None
+        self.feed(text)
+
+    def feed(self, text, seconds=None):
+        # Arithmetic done here runs on the UI thread: under PREVIEW_SECONDS,
+        # over which the state is an error and there is no preview. With
+        # seconds, stops after about that long; returns how much of text
+        # was fed.
+        states = self.states
+        chars = self.chars
+        state = states[-1]
+        position = start = len(chars)
+        chars.extend(text)
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        limits.start(PREVIEW_SECONDS)
+        try:
+            for char in text:
+                if (deadline is not None and (position - start) % _CLOCK_STRIDE == 0
+                        and position > start and time.perf_counter() > deadline):
+                    del chars[position:]
+                    break
+                state = state if state.error else _feed(state, char, chars, position)
+                states.append(state)
+                position += 1
+        finally:
+            limits.stop()
+        return position - start
+
+    def truncate(self, length):
+        # Keep the states for the first length characters only
+        del self.states[length + 1:]
+        del self.chars[length:]
+        self._refeed()
+
+    def pop(self, count=1):
+        count = min(count, len(self.states) - 1)
+        if count > 0:
+            del self.states[-count:]
+            del self.chars[-count:]
+            self._refeed()
+
+    def value(self):
+        # Result of the expression typed so far, or None if it is incomplete
+        # or would fail to evaluate
+        limits.start(PREVIEW_SECONDS)
+        try:
+            state = _flush(self.states[-1], self.chars, len(self.chars))
+            if state.error or state.expect or state.parents is not None:
+                return None
+            return _close(state.operands, state.operators)
+        finally:
+            limits.stop()
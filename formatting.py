@@ -0,0 +1,145 @@
+import decimal
+import math
+from fractions import Fraction
+
+# Decimal places shown for results that aren't whole numbers
+DISPLAY_PLACES = 9
+
+# Numbers with more digits than this before the point are shown in scientific
+# notation; the full digits are only produced on request (full_text)
+FULL_DIGITS = 40
+
+# Significant digits of a scientific rendering
+SIGNIFICANT_DIGITS = 10
+
+# Exact numbers bigger than this (numerator plus denominator bits) are
+# rendered from an approximation instead of exact arithmetic
+EXACT_BITS = 4096
+
+# Bits kept of a huge number when approximating it
+_APPROXIMATION_BITS = 256
+
+# Integers up to this many bits are converted to Decimal directly
+_DIRECT_BITS = 4096
+
+_LOG10_2 = math.log10(2)
+
+# Enough precision for SIGNIFICANT_DIGITS of any approximation, with room
+# for the exponent of the biggest number the engine allows
+_APPROXIMATE = decimal.Context(prec=60, Emax=decimal.MAX_EMAX, Emin=decimal.MIN_EMIN)
+
+
+def estimate_digits(n):
+    # Decimal digits of an integer from its bit length, exact or one too many
+    return int(abs(n).bit_length() * _LOG10_2) + 1
+
+
+def _approximate_int(n):
+    # n to about 60 significant digits, from its top bits only
+    shift = max(0, abs(n).bit_length() - _APPROXIMATION_BITS)
+    top = _APPROXIMATE.create_decimal(abs(n) >> shift)
+    value = _APPROXIMATE.multiply(top, _APPROXIMATE.power(2, shift))
+    return value if n >= 0 else -value
+
+
+def _approximate(value):
+    if type(value) is int:
+        return _approximate_int(value)
+    return _APPROXIMATE.divide(_approximate_int(value.numerator), _approximate_int(value.denominator))
+
+
+def _scientific(value):
+    # value (a Decimal or float) as "1.234567891e+60205", trailing zeros dropped
+    mantissa, _, exponent = f"{value:.{SIGNIFICANT_DIGITS - 1}e}".partition("e")
+    if "." in mantissa:
+        mantissa = mantissa.rstrip("0").rstrip(".")
+    return f"{mantissa}e{exponent}"
+
+
+def _fixed(value, places):
+    # A Decimal with at most places decimals, trailing zeros dropped
+    if value and abs(value) < decimal.Decimal(5).scaleb(-places - 1):
+        # Too small for the fixed decimals, show the significant digits
+        return f"{value:.{places}g}"
+    text = f"{value:.{places}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def format_value(value, places=DISPLAY_PLACES):
+    # Result text: whole numbers in full, others rounded to at most `places`
+    # decimals without trailing zeros. Fractions are rounded exactly, floats
+    # by their exact binary value (the same digits as "%.9f"). Values too
+    # small to show that way get `places` significant digits instead.
+    #
+    # Anything with more than FULL_DIGITS digits before the point is shown in
+    # scientific notation, worked out from the bit length and the top bits,
+    # so the cost doesn't depend on how big the number is.
+    if type(value) is int:
+        if estimate_digits(value) <= FULL_DIGITS:
+            return str(value)
+        return _scientific(_approximate_int(value))
+    if type(value) is float:
+        if not math.isfinite(value):
+            return str(value)
+        if abs(value) >= 10.0 ** FULL_DIGITS:
+            return _scientific(value)
+        value = Fraction(value)
+    elif type(value) is not Fraction:
+        return str(value)
+
+    magnitude_bits = value.numerator.bit_length() - value.denominator.bit_length()
+    if magnitude_bits * _LOG10_2 > FULL_DIGITS:
+        return _scientific(_approximate(value))
+    if value.numerator.bit_length() + value.denominator.bit_length() > EXACT_BITS:
+        return _fixed(_approximate(value), places)
+
+    scaled = round(value * 10 ** places)
+    if scaled == 0 and value != 0:
+        quotient = decimal.Decimal(value.numerator) / decimal.Decimal(value.denominator)
+        return f"{quotient:.{places}g}"
+    sign = "-" if scaled < 0 else ""
+    digits = str(abs(scaled)).rjust(places + 1, "0")
+    whole, decimals = digits[:-places], digits[-places:].rstrip("0")
+    if decimals:
+        return f"{sign}{whole}.{decimals}"
+    return f"{sign}{whole}"
+
+
+def _int_to_decimal(n):
+    # Exact Decimal of an integer of any size. Splitting it in halves by
+    # bits and recombining with Decimal arithmetic (whose big multiplications
+    # are subquadratic) is much faster than str() on huge numbers, and isn't
+    # subject to the int-to-str digit limit.
+    context = decimal.Context(prec=decimal.MAX_PREC, Emax=decimal.MAX_EMAX, Emin=decimal.MIN_EMIN)
+    powers = {}
+
+    def power_of_two(bits):
+        power = powers.get(bits)
+        if power is None:
+            power = powers[bits] = context.power(2, bits)
+        return power
+
+    def convert(n, bits):
+        if bits <= _DIRECT_BITS:
+            return context.create_decimal(n)
+        low_bits = bits >> 1
+        high = n >> low_bits
+        low = n - (high << low_bits)
+        return context.add(convert(low, low_bits),
+                           context.multiply(convert(high, bits - low_bits), power_of_two(low_bits)))
+
+    return convert(abs(n), abs(n).bit_length()), n < 0
+
+
+def full_text(value):
+    # Every digit of a value: integers in full, fractions as numerator/denominator
+    if type(value) is int:
+        digits, negative = _int_to_decimal(value)
+        return f"-{digits}" if negative else str(digits)
+    if type(value) is Fraction:
+        return f"{full_text(value.numerator)}/{full_text(value.denominator)}"
+    if type(value) is float:
+        return repr(value)
+    return str(value)
@@ -0,0 +1,136 @@
+# Number of calculations kept in memory; the oldest ones are evicted first
+DEFAULT_CAPACITY = 10000
+
+# Longest expression or result text stored per entry, longer text is cut
+MAX_FIELD_LENGTH = 256
+
+# Width of a formatted history line in characters
+LINE_WIDTH = 45
+
+
+def _truncate(text):
+    if len(text) > MAX_FIELD_LENGTH:
+        return text[:MAX_FIELD_LENGTH - 1] + "…"
+    return text
+
+
+def format_history_line(expression, result, total_width=LINE_WIDTH):
+    # Format with proper spacing - equation takes 60%, = at boundary, answer takes 40%
+    equation_width = int(total_width * 0.6)
+
+    # Left-align equation, padding to reach the = sign position (60% boundary)
+    equation_to_equals_padding = max(1, equation_width - len(expression))
+
+    # Push answer to the extreme right edge
+    used_space = len(expression) + equation_to_equals_padding + 2 + len(result)  # +2 for "= "
+    answer_padding = max(1, total_width - used_space)
+
+    return f"{expression}{' ' * equation_to_equals_padding}= {' ' * answer_padding}{result}"
+
+
+class HistoryEntry:
+    __slots__ = ("expression", "result")
+
+    def __init__(self, expression, result):
+        self.expression = _truncate(expression)
+        self.result = _truncate(result)
+
+    @property
+    def size_bytes(self):
+        return len(self.expression.encode()) + len(self.result.encode())
+
+    def format(self, total_width=LINE_WIDTH):
+        return format_history_line(self.expression, self.result, total_width)
+
+
+class HistoryModel:
+    # Fixed-size ring buffer of entries: appends and evictions are O(1) and
+    # any entry can be fetched by index, which is all a virtualized view needs.
+    # Index 0 is the oldest entry still kept.
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("history capacity must be at least 1")
+        self._entries = [None] * capacity
+        self._start = 0
+        self._count = 0
+        self._listeners = []
+        # UTF-8 size of the text held, kept up to date on append and eviction
+        self.size_bytes = 0
+        # Entries ever appended; entry n keeps sequence number n even once evicted
+        self.total = 0
+
+    @property
+    def capacity(self):
+        return len(self._entries)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("history index out of range")
+        return self._entries[(self._start + index) % len(self._entries)]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def entry(self, sequence):
+        # Entry by sequence number, None if it has been evicted
+        index = sequence - (self.total - self._count)
+        if 0 <= index < self._count:
+            return self[index]
+        return None
+
+    def connect(self, callback):
+        # callback() is invoked after every change to the model
+        self._listeners.append(callback)
+
+    def _changed(self):
+        for callback in self._listeners:
+            callback()
+
+    def _store(self, entry):
+        capacity = len(self._entries)
+        self.size_bytes += entry.size_bytes
+        self.total += 1
+        if self._count < capacity:
+            self._entries[(self._start + self._count) % capacity] = entry
+            self._count += 1
+        else:
+            # Full: overwrite the oldest entry
+            self.size_bytes -= self._entries[self._start].size_bytes
+            self._entries[self._start] = entry
+            self._start = (self._start + 1) % capacity
+
+    def append(self, expression, result):
+        entry = HistoryEntry(expression, result)
+        self._store(entry)
+        self._changed()
+        return entry
+
+    def extend(self, rows):
+        # Bulk append of (expression, result) pairs with a single notification
+        for expression, result in rows:
+            self._store(HistoryEntry(expression, result))
+        self._changed()
+
+    def clear(self):
+        self._entries = [None] * len(self._entries)
+        self._start = 0
+        self._count = 0
+        self.size_bytes = 0
+        self._changed()
+
+    def set_capacity(self, capacity):
+        if capacity < 1:
+            raise ValueError("history capacity must be at least 1")
+        kept = list(self)[-capacity:]
+        self._entries = kept + [None] * (capacity - len(kept))
+        self._start = 0
+        self._count = len(kept)
+        self.size_bytes = sum(entry.size_bytes for entry in kept)
+        self._changed()
@@ -0,0 +1,219 @@
+import fcntl
+import mmap
+import os
+import queue
+import struct
+import threading
+
+from history import DEFAULT_CAPACITY, HistoryEntry
+
+# Index record per entry: offset and length of its data record
+_INDEX = struct.Struct("<QI")
+
+# Flushed entries are dropped from memory and served from a fresh mapping
+# once this many have piled up
+REMAP_BATCH = 256
+
+# Most records written (and fsync'd) together
+WRITE_BATCH = 1024
+
+
+def default_path():
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data_home, "linux-calculator", "history")
+
+
+def _encode(entry):
+    return f"{entry.expression}\0{entry.result}".encode()
+
+
+def _decode(data):
+    expression, _, result = data.decode().partition("\0")
+    return HistoryEntry(expression, result)
+
+
+class HistoryLog:
+    # Append-only history on disk: <path>.dat holds the variable-length
+    # records, <path>.idx a fixed-width (offset, length) per entry. Both are
+    # memory-mapped on open, so startup cost and resident memory don't depend
+    # on how many entries the log holds; entries are only decoded when asked
+    # for. Appends are kept in memory until a background thread has written
+    # and fsync'd them, so the UI thread never waits for the disk.
+    #
+    # Same interface as HistoryModel; only the newest `capacity` entries are
+    # exposed. One process at a time owns the log: record offsets are
+    # computed from the size seen at open, so a second writer would corrupt
+    # it. Opening a log another process holds raises BlockingIOError.
+
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("history capacity must be at least 1")
+        path = path or default_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.capacity = capacity
+        self._listeners = []
+        self._lock = threading.Lock()
+
+        self._data = open(path + ".dat", "a+b")
+        self._index = open(path + ".idx", "a+b")
+        try:
+            for file in (self._data, self._index):
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._data.close()
+            self._index.close()
+            raise
+        self._durable, self._data_size = self._recover()
+
+        self._data_map = None
+        self._index_map = None
+        self._mapped = 0
+        self._map(self._durable)
+        # Entries appended since the last mapping, oldest first
+        self._tail = []
+        # Size of the data file once every append so far has been written
+        self._size = self._data_size
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _recover(self):
+        # Drop a half-written last record left behind by a crash
+        index_size = os.fstat(self._index.fileno()).st_size
+        data_size = os.fstat(self._data.fileno()).st_size
+        count = index_size // _INDEX.size
+        while count:
+            self._index.seek((count - 1) * _INDEX.size)
+            offset, length = _INDEX.unpack(self._index.read(_INDEX.size))
+            if offset + length <= data_size:
+                data_size = offset + length
+                break
+            count -= 1
+        if count == 0:
+            data_size = 0
+        self._index.truncate(count * _INDEX.size)
+        self._data.truncate(data_size)
+        return count, data_size
+
+    def _map(self, count):
+        # Map the first count entries; mappings are cheap, pages load lazily
+        for old in (self._data_map, self._index_map):
+            if old is not None:
+                old.close()
+        self._data_map = self._index_map = None
+        if count:
+            self._index_map = mmap.mmap(self._index.fileno(), count * _INDEX.size, access=mmap.ACCESS_READ)
+            offset, length = _INDEX.unpack_from(self._index_map, (count - 1) * _INDEX.size)
+            if offset + length:
+                self._data_map = mmap.mmap(self._data.fileno(), offset + length, access=mmap.ACCESS_READ)
+        self._mapped = count
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            records = [record for record in batch if record is not None]
+            if records:
+                index = bytearray()
+                offset = self._data_size
+                for record in records:
+                    index += _INDEX.pack(offset, len(record))
+                    offset += len(record)
+                # Data first, so the index never points past the data on disk
+                self._data.write(b"".join(records))
+                self._data.flush()
+                os.fsync(self._data.fileno())
+                self._index.write(index)
+                self._index.flush()
+                os.fsync(self._index.fileno())
+                self._data_size = offset
+                with self._lock:
+                    self._durable += len(records)
+            if stop:
+                return
+
+    @property
+    def total(self):
+        # Every entry in the log, including ones not exposed by capacity
+        return self._mapped + len(self._tail)
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("history index out of range")
+        return self.entry(index + self.total - length)
+
+    def entry(self, sequence):
+        # Any entry in the log by position, including ones outside capacity
+        if sequence >= self._mapped:
+            return self._tail[sequence - self._mapped]
+        offset, size = _INDEX.unpack_from(self._index_map, sequence * _INDEX.size)
+        return _decode(self._data_map[offset:offset + size])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def connect(self, callback):
+        # callback() is invoked after every change to the log
+        self._listeners.append(callback)
+
+    def _changed(self):
+        for callback in self._listeners:
+            callback()
+
+    def _store(self, entry):
+        record = _encode(entry)
+        self._tail.append(entry)
+        self._size += len(record)
+        self._queue.put(record)
+
+    def _remap_if_needed(self):
+        with self._lock:
+            durable = self._durable
+        flushed = durable - self._mapped
+        if flushed >= REMAP_BATCH:
+            self._map(durable)
+            del self._tail[:flushed]
+
+    def append(self, expression, result):
+        entry = HistoryEntry(expression, result)
+        self._store(entry)
+        self._remap_if_needed()
+        self._changed()
+        return entry
+
+    def extend(self, rows):
+        for expression, result in rows:
+            self._store(HistoryEntry(expression, result))
+        self._remap_if_needed()
+        self._changed()
+
+    def set_capacity(self, capacity):
+        if capacity < 1:
+            raise ValueError("history capacity must be at least 1")
+        self.capacity = capacity
+        self._changed()
+
+    def close(self):
+        # Waits for pending appends to reach the disk
+        self._queue.put(None)
+        self._writer.join()
+        self._map(0)
+        self._data.close()
+        self._index.close()
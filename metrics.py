@@ -0,0 +1,104 @@
+import cProfile
+import os
+import time
+import tracemalloc
+from collections import Counter
+
+
+def _length_bucket(length):
+    # Power-of-two buckets: "0", "1", "2-3", "4-7", "8-15", ...
+    if length < 2:
+        return str(length)
+    low = 1 << (length.bit_length() - 1)
+    return f"{low}-{2 * low - 1}"
+
+
+class Metrics:
+    # Counters and timings for evaluations done on behalf of one backend,
+    # wherever they ran (in process or in a worker)
+
+    def __init__(self):
+        self.evaluations = 0
+        self.errors = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.evaluate_seconds = 0.0
+        self.max_evaluate_seconds = 0.0
+        self.lengths = Counter()
+
+    def record(self, expression, error=None, seconds=None, cache_hit=None):
+        self.evaluations += 1
+        self.lengths[_length_bucket(len(expression))] += 1
+        if error is not None:
+            self.errors[getattr(error, "kind", type(error).__name__)] += 1
+        if seconds is not None:
+            self.evaluate_seconds += seconds
+            self.max_evaluate_seconds = max(self.max_evaluate_seconds, seconds)
+        if cache_hit is True:
+            self.cache_hits += 1
+        elif cache_hit is False:
+            self.cache_misses += 1
+
+    def reset(self):
+        self.__init__()
+
+    def snapshot(self):
+        return {
+            "evaluations": self.evaluations,
+            "errors": dict(self.errors),
+            "parse_cache": {"hits": self.cache_hits, "misses": self.cache_misses},
+            "evaluate_seconds": {
+                "total": self.evaluate_seconds,
+                "mean": self.evaluate_seconds / self.evaluations if self.evaluations else 0.0,
+                "max": self.max_evaluate_seconds,
+            },
+            "expression_length": dict(sorted(self.lengths.items(), key=lambda item: int(item[0].split("-")[0]))),
+        }
+
+
+class Profiler:
+    # cProfile plus tracemalloc, switched on and off while the app runs.
+    # stop() writes a .prof file (for pstats / snakeviz) and the top memory
+    # allocation sites as text, and returns their paths.
+
+    def __init__(self):
+        self._profile = None
+        self._started_tracemalloc = False
+
+    @property
+    def active(self):
+        return self._profile is not None
+
+    def start(self):
+        if self.active:
+            return
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self, directory, limit=50):
+        if not self.active:
+            return []
+        self._profile.disable()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        profile_path = os.path.join(directory, f"calculator-{stamp}.prof")
+        self._profile.dump_stats(profile_path)
+        self._profile = None
+
+        memory_path = os.path.join(directory, f"calculator-{stamp}-memory.txt")
+        snapshot = tracemalloc.take_snapshot()
+        with open(memory_path, "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("lineno")[:limit]:
+                f.write(f"{stat}\n")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return [profile_path, memory_path]
+
+    def toggle(self, directory):
+        if self.active:
+            return self.stop(directory)
+        self.start()
+        return []
@@ -0,0 +1,167 @@
+import math
+
+from engine import ExpressionError, free_names, parse_expression
+from sweep import _float_constant, _require_numpy, compile_vectorized, np
+
+# Samples taken per pixel column when the view needs sampling
+OVERSAMPLE = 4
+
+# Samples per column before the grid is coarsened (zooming out)
+MAX_DETAIL = 1024
+
+# Most samples kept; panning further drops those farthest from the view
+MAX_SAMPLES = 10_000_000
+
+# Samples evaluated per array operation, to bound the temporaries
+CHUNK = 1 << 18
+
+# Samples per block at the finest min/max level; columns with fewer
+# samples than twice this are reduced from the samples themselves
+BASE_BLOCK = 8
+
+
+def compile_plot(expression, env=None):
+    # (variable, function) for an expression in one free variable, where
+    # function maps an array of x to an array of y. Names with a value in
+    # env (the worksheet's variables) are constants.
+    _require_numpy()
+    constants = {name: _float_constant(value) for name, value in (env or {}).items()}
+    names = free_names(parse_expression(expression)) - constants.keys()
+    if len(names) != 1:
+        found = ", ".join(sorted(names)) if names else "none"
+        raise ExpressionError(f"expected one free variable to plot, found {found}")
+    variable = names.pop()
+    _, compiled = compile_vectorized(expression, variable, constants)
+
+    def function(xs):
+        ys = compiled(dict(constants, **{variable: xs}))
+        # An expression not using the variable still gives one y per x
+        return np.broadcast_to(np.asarray(ys, dtype=np.float64), xs.shape)
+    return variable, function
+
+
+def _sample(function, first, stop, step):
+    # function at grid points first..stop-1 (x = index × step), in chunks
+    ys = np.empty(max(0, stop - first), dtype=np.float64)
+    with np.errstate(all="ignore"):
+        for start in range(0, len(ys), CHUNK):
+            xs = np.arange(first + start, first + min(start + CHUNK, len(ys)), dtype=np.float64) * step
+            try:
+                ys[start:start + len(xs)] = function(xs)
+            except (ArithmeticError, ValueError, TypeError) as e:
+                raise ExpressionError(str(e), type(e).__name__) from e
+    return ys
+
+
+def _pyramid(ys):
+    # Min/max of blocks of BASE_BLOCK, 2×BASE_BLOCK, ... samples. NaN
+    # (undefined points) is ignored unless a whole block is undefined.
+    levels = []
+    mins = maxs = ys
+    block = 1
+    while len(mins) > 1:
+        if len(mins) % 2:
+            # The last block is a short one
+            mins = np.append(mins, mins[-1])
+            maxs = np.append(maxs, maxs[-1])
+        mins = np.fmin(mins[0::2], mins[1::2])
+        maxs = np.fmax(maxs[0::2], maxs[1::2])
+        block *= 2
+        if block >= BASE_BLOCK:
+            levels.append((mins, maxs))
+    return levels
+
+
+def _column_extremes(mins, maxs, starts):
+    # Min and max of mins/maxs between consecutive starts, NaN where empty
+    starts = np.clip(starts, 0, len(mins))
+    low, high = starts[:-1], starts[1:]
+    filled = high > low
+    column_mins = np.full(len(low), np.nan)
+    column_maxs = np.full(len(low), np.nan)
+    if filled.any():
+        # Columns are contiguous, so each filled one ends where the next
+        # filled one starts; only the last needs cutting off
+        end = high[filled][-1]
+        column_mins[filled] = np.fmin.reduceat(mins[:end], low[filled])
+        column_maxs[filled] = np.fmax.reduceat(maxs[:end], low[filled])
+    return column_mins, column_maxs
+
+
+class SampleGrid:
+    # Function values at x = index × step for a run of consecutive indexes,
+    # starting at first. step is a power of two, so the grids for different
+    # zoom levels nest: coarsening one is a slice, never an evaluation.
+    # levels is the min/max pyramid used to draw many samples per column.
+    __slots__ = ("step", "first", "ys", "levels")
+
+    def __init__(self, step, first, ys):
+        self.step = step
+        self.first = first
+        self.ys = ys
+        self.levels = _pyramid(ys)
+
+    @property
+    def stop(self):
+        return self.first + len(self.ys)
+
+    def coarsened(self, step):
+        # Only the samples that are also on the coarser grid
+        factor = round(step / self.step)
+        offset = -self.first % factor
+        return SampleGrid(step, (self.first + offset) // factor, self.ys[offset::factor].copy())
+
+    def serves(self, x0, x1, columns):
+        # Whether resample() would return this grid as it is
+        wanted = (x1 - x0) / (columns * OVERSAMPLE)
+        return (wanted / MAX_DETAIL <= self.step <= wanted and math.floor(x0 / self.step) >= self.first
+                and math.ceil(x1 / self.step) + 1 <= self.stop)
+
+    def envelope(self, x0, x1, columns):
+        # (mins, maxs): extremes of the samples in each of columns equal
+        # slices of x0..x1, NaN for columns with nothing sampled
+        edges = np.ceil(np.linspace(x0, x1, columns + 1) / self.step) - self.first
+        per_column = (x1 - x0) / self.step / columns
+        block = 2 ** int(math.log2(per_column / 2)) if per_column >= 2 * BASE_BLOCK else 1
+        if block == 1 or not self.levels:
+            return _column_extremes(self.ys, self.ys, edges.astype(np.int64))
+        # Each column spans at least two blocks, so cutting columns at block
+        # boundaries moves an edge by at most half a column
+        level = min(int(math.log2(block // BASE_BLOCK)), len(self.levels) - 1)
+        mins, maxs = self.levels[level]
+        block = BASE_BLOCK << level
+        return _column_extremes(mins, maxs, (edges // block).astype(np.int64))
+
+
+def resample(grid, function, x0, x1, columns):
+    # A grid that covers x0..x1 in enough detail for columns pixel columns.
+    # Samples already in grid are kept: panning evaluates only the newly
+    # exposed range, zooming out only what the coarser grid doesn't have.
+    # Zooming in past the grid's detail samples the view afresh.
+    if grid is not None and grid.serves(x0, x1, columns):
+        return grid
+    wanted = (x1 - x0) / (columns * OVERSAMPLE)
+    if grid is not None and not wanted / MAX_DETAIL <= grid.step <= wanted:
+        step = 2.0 ** math.floor(math.log2(wanted))
+        grid = grid.coarsened(step) if grid.step < step else None
+    else:
+        step = grid.step if grid is not None else 2.0 ** math.floor(math.log2(wanted))
+
+    first = math.floor(x0 / step)
+    stop = math.ceil(x1 / step) + 1
+    if grid is None or stop <= grid.first or first >= grid.stop:
+        return SampleGrid(step, first, _sample(function, first, stop, step))
+    if first >= grid.first and stop <= grid.stop:
+        # Coarsening was all it needed
+        return grid
+
+    left = _sample(function, first, grid.first, step)
+    right = _sample(function, grid.stop, stop, step)
+    ys = np.concatenate((left, grid.ys, right))
+    start = min(first, grid.first)
+    if len(ys) > MAX_SAMPLES:
+        # Keep the view and as much as fits around it
+        keep = max(0, min(first - start - (MAX_SAMPLES - (stop - first)) // 2, len(ys) - MAX_SAMPLES))
+        ys = ys[keep:keep + MAX_SAMPLES].copy()
+        start += keep
+    return SampleGrid(step, start, ys)
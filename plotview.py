@@ -0,0 +1,197 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, Gdk
+
+from engine import ExpressionError
+from plot import np, resample
+from sweep import format_number
+
+# x range a new plot view shows, centred on 0
+DEFAULT_SPAN = 20.0
+
+# Narrowest and widest x range the plot zooms to
+MIN_SPAN = 1e-9
+MAX_SPAN = 1e12
+
+# Zoom factor per scroll step
+ZOOM_STEP = 1.25
+
+
+class PlotView(Gtk.DrawingArea):
+    # Plot of an expression in one variable (see plot.py). Scrolling zooms
+    # around the pointer, dragging pans. A redraw only reduces samples that
+    # are already there to one min/max pair per pixel column; sampling runs
+    # on a background thread, for just the range that panning or zooming
+    # has exposed, and results are handed to post(callback, *args) (e.g.
+    # GLib.idle_add) to be drawn. Until then the exposed part stays blank.
+
+    def __init__(self, post=None):
+        super().__init__()
+        self._post = post or (lambda callback, *args: callback(*args))
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="plot")
+        self.expression = None
+        self.function = None
+        self.grid = None
+        self.error = None
+        self.x0, self.x1 = -DEFAULT_SPAN / 2, DEFAULT_SPAN / 2
+        # Bumped for every new function, so samples of an old one are dropped
+        self._generation = 0
+        self._sampling = False
+        self._drag = None
+
+        self.add_events(Gdk.EventMask.SCROLL_MASK | Gdk.EventMask.SMOOTH_SCROLL_MASK
+                        | Gdk.EventMask.BUTTON_PRESS_MASK | Gdk.EventMask.BUTTON_RELEASE_MASK
+                        | Gdk.EventMask.BUTTON1_MOTION_MASK)
+        self.connect("draw", self.on_draw)
+        self.connect("scroll-event", self.on_scroll)
+        self.connect("button-press-event", self.on_button_press)
+        self.connect("motion-notify-event", self.on_motion)
+        self.connect("button-release-event", lambda widget, event: setattr(self, "_drag", None))
+        self.connect("destroy", lambda widget: self._executor.shutdown(wait=False, cancel_futures=True))
+
+    def plot(self, expression, function):
+        # function maps an array of x to an array of y, see compile_plot()
+        self.expression = expression
+        self.function = function
+        self.grid = None
+        self.error = None
+        self._generation += 1
+        self.queue_draw()
+
+    def set_range(self, x0, x1):
+        span = min(max(x1 - x0, MIN_SPAN), MAX_SPAN)
+        middle = (x0 + x1) / 2
+        self.x0, self.x1 = middle - span / 2, middle + span / 2
+        self.queue_draw()
+
+    def request_samples(self, columns):
+        # One job at a time; the redraw after it asks again if the view has
+        # moved on in the meantime
+        if self._sampling or self.function is None or self.error is not None:
+            return
+        if self.grid is not None and self.grid.serves(self.x0, self.x1, columns):
+            return
+        self._sampling = True
+        self._executor.submit(self._sample, self._generation, self.grid, self.function,
+                              self.x0, self.x1, columns)
+
+    def _sample(self, generation, grid, function, x0, x1, columns):
+        # On the sampling thread. Whatever happens, the view hears back, or
+        # it would wait for this job forever.
+        sampled = error = None
+        try:
+            sampled = resample(grid, function, x0, x1, columns)
+        except ExpressionError as e:
+            error = e
+        except Exception as e:
+            # Out of memory near MAX_SAMPLES, say
+            error = ExpressionError(f"can't plot: {type(e).__name__}: {e}", type(e).__name__)
+        finally:
+            self._post(self._on_sampled, generation, sampled, error)
+
+    def _on_sampled(self, generation, grid, error):
+        self._sampling = False
+        if generation == self._generation:
+            self.grid = grid
+            self.error = error
+        self.queue_draw()
+        return False
+
+    def on_scroll(self, widget, event):
+        if event.direction == Gdk.ScrollDirection.UP:
+            steps = -1
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            steps = 1
+        elif event.direction == Gdk.ScrollDirection.SMOOTH:
+            steps = event.get_scroll_deltas()[2]
+        else:
+            return False
+        factor = ZOOM_STEP ** steps
+        # The x under the pointer stays put
+        pointer = self.x0 + event.x / max(1, self.get_allocated_width()) * (self.x1 - self.x0)
+        self.set_range(pointer - (pointer - self.x0) * factor, pointer + (self.x1 - pointer) * factor)
+        return True
+
+    def on_button_press(self, widget, event):
+        if event.button == 1:
+            self._drag = (event.x, self.x0, self.x1)
+        return False
+
+    def on_motion(self, widget, event):
+        if self._drag is None:
+            return False
+        start, x0, x1 = self._drag
+        shift = (event.x - start) / max(1, self.get_allocated_width()) * (x1 - x0)
+        self.x0, self.x1 = x0 - shift, x1 - shift
+        self.queue_draw()
+        return True
+
+    def on_draw(self, widget, cr):
+        context = widget.get_style_context()
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        Gtk.render_background(context, cr, 0, 0, width, height)
+        if width < 2:
+            return False
+        self.request_samples(width)
+
+        layout = widget.create_pango_layout("")
+        padding = context.get_padding(context.get_state())
+        if self.error is not None:
+            layout.set_text(str(self.error), -1)
+            Gtk.render_layout(context, cr, padding.left, padding.top, layout)
+            return False
+        if self.grid is None:
+            return False
+
+        mins, maxs = self.grid.envelope(self.x0, self.x1, width)
+        # y range from what is on screen, leaving out the steepest 2% at
+        # either end so a pole doesn't flatten the rest
+        finite = np.concatenate((mins, maxs))
+        finite = finite[np.isfinite(finite)]
+        if not len(finite):
+            return False
+        y0, y1 = np.percentile(finite, (2, 98))
+        margin = (y1 - y0) * 0.1 or max(1.0, abs(y0) * 0.1)
+        y0, y1 = y0 - margin, y1 + margin
+        scale = height / (y1 - y0)
+
+        color = context.get_color(context.get_state())
+        # Axes, where they are in view
+        cr.set_source_rgba(color.red, color.green, color.blue, 0.25)
+        cr.set_line_width(1)
+        if y0 < 0 < y1:
+            cr.move_to(0, round(y1 * scale) + 0.5)
+            cr.line_to(width, round(y1 * scale) + 0.5)
+        if self.x0 < 0 < self.x1:
+            column = round(-self.x0 / (self.x1 - self.x0) * width) + 0.5
+            cr.move_to(column, 0)
+            cr.line_to(column, height)
+        cr.stroke()
+
+        # One vertical stroke per column, from its max to its min, joined to
+        # the next; undefined columns break the line
+        tops = np.clip((y1 - maxs) * scale, -height, 2 * height).tolist()
+        bottoms = np.clip((y1 - mins) * scale, -height, 2 * height).tolist()
+        cr.set_source_rgba(color.red, color.green, color.blue, color.alpha)
+        cr.set_line_width(1.5)
+        drawing = False
+        for column in range(width):
+            top = tops[column]
+            if top != top:
+                drawing = False
+                continue
+            if drawing:
+                cr.line_to(column + 0.5, top)
+            else:
+                cr.move_to(column + 0.5, top)
+            cr.line_to(column + 0.5, bottoms[column])
+            drawing = True
+        cr.stroke()
+
+        layout.set_text(f"{self.expression}\n{format_number(self.x0)} … {format_number(self.x1)}, "
+                        f"y {format_number(y0)} … {format_number(y1)}", -1)
+        Gtk.render_layout(context, cr, padding.left, padding.top, layout)
+        return False
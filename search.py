@@ -0,0 +1,196 @@
+import time
+from array import array
+from itertools import islice, takewhile
+from bisect import bisect_left, bisect_right
+
+# Lengths of the substrings indexed. Queries use the longest that fits:
+# with a dozen symbols making up most of the text, 4-grams are far more
+# selective than trigrams, which are only there for 3-character queries.
+GRAM_SIZES = (3, 4)
+
+# Most matches returned by a search, a few screens of the history pane
+DEFAULT_LIMIT = 50
+
+# Entries scanned, newest first, for queries too short to use the index;
+# checking one costs about 0.4µs
+SHORT_SCAN = 2000
+
+# Most candidates checked against the text for a longer query, for the
+# rare query whose n-grams are all common but seldom next to each other
+MAX_CHECKED = 2000
+
+# Entries evicted from the model before the postings are trimmed of them
+PRUNE_BATCH = 1024
+
+# Newest entries of an existing log that are indexed; older ones aren't
+# searched. Indexing costs about 14µs and 75 bytes per entry, so a log of
+# millions would otherwise cost seconds of CPU and tens of MB every launch.
+MAX_INDEXED = 100000
+
+# Entries indexed between checks of the time budget in update()
+_CLOCK_STRIDE = 64
+
+
+def _text(entry):
+    return f"{entry.expression} = {entry.result}".lower()
+
+
+def _grams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _intersect_newest_first(lists):
+    # Leapfrog intersection of ascending id lists, walking down from the
+    # newest id: each list is binary-searched for the next candidate, so the
+    # cost follows the number of near-misses rather than the list lengths
+    candidate = min(ids[-1] for ids in lists)
+    ends = [len(ids) for ids in lists]
+    agreed = 0
+    index = 0
+    while True:
+        ids = lists[index]
+        end = bisect_right(ids, candidate, 0, ends[index])
+        if end == 0:
+            return
+        ends[index] = end
+        found = ids[end - 1]
+        if found != candidate:
+            candidate = found
+            agreed = 0
+        agreed += 1
+        if agreed == len(lists):
+            yield candidate
+            candidate -= 1
+            agreed = 0
+        index = (index + 1) % len(lists)
+
+
+class HistoryIndex:
+    # N-gram index over "expression = result" of every history entry.
+    # Each n-gram maps to the ascending sequence numbers of the entries
+    # containing it, so a query only touches entries that share all of its
+    # n-grams, and the index is extended entry by entry as history grows.
+    # Works over a HistoryModel or a HistoryLog (anything with total,
+    # entry(sequence) and a length of how many newest entries it exposes).
+    # Ids of entries no longer exposed are trimmed from the postings in
+    # batches, so the index stays the size of the model, not of everything
+    # ever added. Of the entries already there, only the newest max_entries
+    # are indexed.
+
+    def __init__(self, model, max_entries=MAX_INDEXED):
+        self.model = model
+        self.indexed = max(0, model.total - min(max_entries, len(model)))
+        self._postings = {}
+        # Ids below floor are dropped; grams whose postings are still to be trimmed
+        self._floor = self.indexed
+        self._sweep = []
+
+    @property
+    def floor(self):
+        # Oldest sequence number the model still exposes
+        return self.model.total - len(self.model)
+
+    @property
+    def pending(self):
+        return self.model.total - self.indexed + len(self._sweep)
+
+    def update(self, limit=None, seconds=None):
+        # Index up to limit new entries, or for about seconds, then trim
+        # evicted ids for what is left of that time; returns True while
+        # some work is left
+        end = self.model.total
+        if limit is not None:
+            end = min(end, self.indexed + limit)
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        postings = self._postings
+        for sequence in range(max(self.indexed, self.floor), end):
+            if deadline is not None and sequence % _CLOCK_STRIDE == 0 and time.perf_counter() > deadline:
+                end = sequence
+                break
+            entry = self.model.entry(sequence)
+            if entry is None:
+                continue
+            text = _text(entry)
+            for size in GRAM_SIZES:
+                for gram in _grams(text, size):
+                    ids = postings.get(gram)
+                    if ids is None:
+                        ids = postings[gram] = array("I")
+                    ids.append(sequence)
+        self.indexed = max(self.indexed, end)
+        self._prune(deadline)
+        return self.pending > 0
+
+    def _prune(self, deadline=None):
+        floor = self.floor
+        if not self._sweep and floor - self._floor >= PRUNE_BATCH:
+            self._floor = floor
+            self._sweep = list(self._postings)
+        sweep = self._sweep
+        postings = self._postings
+        while sweep:
+            if deadline is not None and len(sweep) % _CLOCK_STRIDE == 0 and time.perf_counter() > deadline:
+                break
+            gram = sweep.pop()
+            ids = postings.get(gram)
+            if ids is None:
+                continue
+            cut = bisect_left(ids, self._floor)
+            if cut == len(ids):
+                del postings[gram]
+            elif cut:
+                del ids[:cut]
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        # Matching (sequence, entry) pairs, newest first
+        query = query.strip().lower()
+        if not query:
+            return []
+        floor = self.floor
+        if len(query) < GRAM_SIZES[0]:
+            candidates = range(self.indexed - 1, max(floor, self.indexed - SHORT_SCAN) - 1, -1)
+        else:
+            lists = []
+            size = max(size for size in GRAM_SIZES if size <= len(query))
+            for gram in _grams(query, size):
+                ids = self._postings.get(gram)
+                if ids is None:
+                    return []
+                lists.append(ids)
+            lists.sort(key=len)
+            candidates = islice(takewhile(lambda sequence: sequence >= floor,
+                                          _intersect_newest_first(lists)), MAX_CHECKED)
+
+        matches = []
+        for sequence in candidates:
+            entry = self.model.entry(sequence)
+            # Sharing every trigram doesn't make it a substring, check the text
+            if entry is not None and query in _text(entry):
+                matches.append((sequence, entry))
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+class SearchResults:
+    # Read-only model of search matches for a HistoryView, oldest at the top
+    # like the history itself
+
+    def __init__(self, matches=()):
+        self._entries = [entry for _, entry in reversed(matches)]
+        self._listeners = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def connect(self, callback):
+        self._listeners.append(callback)
+
+    def newest(self):
+        return self._entries[-1] if self._entries else None
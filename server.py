@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import errno
+import json
+import multiprocessing
+import os
+import stat
+import sys
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+from backend import CalculatorBackend, timed_compute
+from history import HistoryModel
+
+# Calculations kept per session; the ring buffer is allocated up front, so
+# this is most of what an idle session costs
+SESSION_HISTORY = 100
+
+# Longest request line accepted, longer ones close the connection
+MAX_LINE = 1 << 20
+
+# Requests a connection may have in flight before reading from it pauses
+MAX_IN_FLIGHT = 64
+
+# Operations that evaluate the whole expression, and run in the executor
+_EVALUATING = {"=": "=", "√": "√", "x²": "x²"}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def process_executor(jobs=None):
+    # Workers must not be forked from the server: a forked worker inherits
+    # the client sockets open at that moment, and a client closing its end
+    # would then never be seen as EOF
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["backend"])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(jobs, mp_context=context)
+
+
+class Session:
+    # One calculator: an expression with its parser state, and a history.
+    # Requests to a session run one after another, in the order received.
+    __slots__ = ("backend", "history", "tail")
+
+    def __init__(self):
+        self.backend = CalculatorBackend()
+        self.history = HistoryModel(SESSION_HISTORY)
+        # Task of the last request queued for this session
+        self.tail = None
+
+    def state(self):
+        backend = self.backend
+        return {"expression": backend.expression, "cursor": backend.cursor, "preview": backend.preview()}
+
+
+class CalculatorServer:
+    # Calculator sessions over line-delimited JSON. Each request line is an
+    # object such as {"id": 1, "session": "a", "op": "input", "text": "12×3"};
+    # each gets one reply line with the same id, the session's expression,
+    # cursor and preview, and whatever the operation returns. Requests can be
+    # pipelined: a connection keeps reading while earlier ones run. Requests
+    # to the same session are answered in order, different sessions proceed
+    # independently. Sessions belong to their connection ("session" defaults
+    # to "") and are dropped when it closes.
+    #
+    # Editing is cheap and done on the event loop; evaluations run in an
+    # executor (a process pool of jobs workers by default), so a slow one
+    # only holds up its own session. A process pool that breaks (a worker
+    # killed, out of memory...) is replaced.
+
+    def __init__(self, executor=None, jobs=None):
+        self.jobs = jobs
+        self.executor = executor or process_executor(jobs)
+        self.connections = 0
+        self.sessions = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        sessions = {}
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Over MAX_LINE, the stream can't be resynchronised
+                    self._send(writer, {"id": None, "error": f"request longer than {MAX_LINE} bytes"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await in_flight.acquire()
+                task = asyncio.ensure_future(self._respond(sessions, line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                task.add_done_callback(lambda _: in_flight.release())
+                # Stop reading while the client isn't reading its replies
+                await writer.drain()
+            if pending:
+                await asyncio.wait(pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            self.connections -= 1
+            self.sessions -= len(sessions)
+            writer.close()
+
+    def _send(self, writer, reply):
+        if not writer.is_closing():
+            writer.write(json.dumps(reply, ensure_ascii=False).encode() + b"\n")
+
+    async def _respond(self, sessions, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ProtocolError("request must be a JSON object")
+            request_id = request.get("id")
+            name = request.get("session", "")
+            if not isinstance(name, str):
+                raise ProtocolError("session must be a string")
+            session = sessions.get(name)
+            if session is None:
+                session = sessions[name] = Session()
+                self.sessions += 1
+            # Chain onto the session's previous request to keep its order
+            previous = session.tail
+            session.tail = asyncio.current_task()
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            reply = await self._run(session, request)
+            # A pipelined close may find the session already closed, or
+            # another request may have opened a new one under the name since
+            if request.get("op") == "close" and sessions.get(name) is session:
+                del sessions[name]
+                self.sessions -= 1
+        except (ProtocolError, ValueError) as e:
+            reply = {"error": str(e)}
+        except Exception as e:
+            # Still answer, the client may be waiting for this id
+            reply = {"error": f"internal error: {type(e).__name__}: {e}"}
+        reply["id"] = request_id
+        self._send(writer, reply)
+
+    async def _run(self, session, request):
+        backend = session.backend
+        op = request.get("op")
+        reply = {}
+        if op == "input":
+            text = request.get("text")
+            if not isinstance(text, str):
+                raise ProtocolError("input needs a text string")
+            if text in _EVALUATING and backend.expression:
+                reply = await self._evaluate(session, _EVALUATING[text])
+            elif text in _EVALUATING:
+                # √ on an empty expression starts a root
+                backend.input(text)
+            else:
+                backend.paste(text)
+        elif op == "evaluate":
+            reply = await self._evaluate(session, "=")
+        elif op == "backspace":
+            backend.backspace()
+        elif op == "clear":
+            backend.clear()
+        elif op == "undo":
+            backend.undo()
+        elif op == "redo":
+            backend.redo()
+        elif op == "cursor":
+            position = request.get("position")
+            if not isinstance(position, int):
+                raise ProtocolError("cursor needs an integer position")
+            backend.move_cursor(position)
+        elif op == "recall":
+            text = request.get("text")
+            if not isinstance(text, str):
+                raise ProtocolError("recall needs a text string")
+            backend.recall(text)
+        elif op == "history":
+            reply = {"history": [[entry.expression, entry.result] for entry in session.history]}
+        elif op == "variables":
+            sheet = backend.sheet
+            reply = {"variables": {name: sheet.lines[index].text for name, index in sheet.variables.items()}}
+        elif op == "full":
+            # Every digit of the last result, which may be shown shortened
+            reply = {"full": backend.full_result()}
+        elif op == "close":
+            return {"closed": True}
+        elif op != "state":
+            raise ProtocolError(f"unknown op: {op!r}")
+        reply.update(session.state())
+        return reply
+
+    async def _compute(self, expression, operation, seed=None, env=None):
+        # timed_compute() in the executor, never on the event loop
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, timed_compute, expression, operation, seed, env)
+        except BrokenExecutor:
+            if executor is self.executor and isinstance(executor, ProcessPoolExecutor):
+                executor.shutdown(wait=False)
+                self.executor = process_executor(self.jobs)
+            raise
+
+    async def _evaluate(self, session, operation):
+        backend = session.backend
+        expression = backend.expression
+        outcome = await self._compute(expression, operation, backend.seed, backend.env)
+        text = backend.apply(operation, *outcome)
+        error = backend.last_error
+        reply = {"result": text, "error": None if error is None else str(error)}
+        if operation == "=":
+            session.history.append(expression, text)
+            # Lines that depended on a variable this redefined, one job each
+            sheet = backend.sheet
+            lines = []
+            for index in sheet.stale_order():
+                body, env = sheet.job(index)
+                value, line_text, line_error, _, _ = await self._compute(body, "=", None, env)
+                sheet.update(index, value, line_text, line_error)
+                lines.append(sheet.lines[index])
+            session.history.extend((line.expression, line.text) for line in lines)
+            reply["recomputed"] = [[line.expression, line.text] for line in lines]
+        return reply
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+async def serve(server, socket_path=None, host="127.0.0.1", port=None):
+    if socket_path is not None:
+        # Replace a socket left behind by an earlier run, nothing else
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(errno.EEXIST, "exists and is not a socket", socket_path)
+            os.unlink(socket_path)
+        listener = await asyncio.start_unix_server(server.handle, path=socket_path, limit=MAX_LINE)
+    else:
+        listener = await asyncio.start_server(server.handle, host=host, port=port, limit=MAX_LINE)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve calculator sessions as line-delimited JSON.")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", metavar="PATH", help="listen on a Unix socket")
+    where.add_argument("--port", type=int, help="listen on localhost TCP")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address to bind (default: 127.0.0.1)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes for evaluations (default: CPU count)")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    server = CalculatorServer(jobs=args.jobs)
+    try:
+        asyncio.run(serve(server, args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    except FileExistsError as e:
+        parser.error(f"--socket {e.filename}: {e.strerror}")
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
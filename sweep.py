@@ -0,0 +1,148 @@
+import argparse
+import math
+import sys
+
+from engine import OPERATIONS, ExpressionError, compile_tree, free_names, parse_expression
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Most rows of a table handed to the history pane
+MAX_TABLE_ROWS = 1000
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("sweeps need NumPy (pip install numpy)")
+
+
+def _float_constant(value):
+    # Exact literals (ints, Fractions) as float64, the sweep's only dtype
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+
+def _vector_operations():
+    # Same operators as the scalar engine, applied element-wise. float_power
+    # avoids NumPy's error for integers raised to negative integer powers.
+    operations = dict(OPERATIONS)
+    operations.update({
+        "const": _float_constant,
+        "+": np.add,
+        "-": np.subtract,
+        "*": np.multiply,
+        "/": np.true_divide,
+        "//": np.floor_divide,
+        "%": np.mod,
+        "**": np.float_power,
+        "pos": np.positive,
+        "neg": np.negative,
+        "√": np.sqrt,
+    })
+    return operations
+
+
+def format_number(value):
+    # Same style as results in the history: at most 9 decimals, no trailing zeros
+    value = float(value)
+    if value != value or value in (float("inf"), float("-inf")):
+        return str(value)
+    return f"{value:.9f}".rstrip('0').rstrip('.')
+
+
+def compile_vectorized(expression, variable=None, known=()):
+    # Returns (variable name, closure) where closure(env) works on arrays.
+    # Names in known are given values in env too, they aren't the variable.
+    _require_numpy()
+    tree = parse_expression(expression)
+    names = free_names(tree) - set(known)
+    if variable is None:
+        if len(names) > 1:
+            raise ExpressionError(f"expected one free variable, found {', '.join(sorted(names))}")
+        variable = names.pop() if names else "x"
+    elif names - {variable}:
+        raise ExpressionError(f"unknown name {sorted(names - {variable})[0]!r}", "name")
+    return variable, compile_tree(tree, _vector_operations())
+
+
+class SweepTable:
+    __slots__ = ("expression", "variable", "inputs", "outputs")
+
+    def __init__(self, expression, variable, inputs, outputs):
+        self.expression = expression
+        self.variable = variable
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def rows(self, limit=MAX_TABLE_ROWS):
+        # (input, result) text pairs for display, at most limit of them
+        for x, y in zip(self.inputs[:limit], self.outputs[:limit]):
+            yield f"{self.variable} = {format_number(x)}", format_number(y)
+
+
+def sweep(expression, values, variable=None, env=None):
+    # Evaluate expression for every value in one pass of array operations.
+    # Invalid points (division by zero, √ of a negative...) become inf/nan.
+    # Names with a value in env (the worksheet's variables) are constants.
+    _require_numpy()
+    constants = {name: _float_constant(value) for name, value in (env or {}).items()}
+    variable, compiled = compile_vectorized(expression, variable, constants)
+    inputs = np.asarray(values, dtype=np.float64)
+    with np.errstate(all="ignore"):
+        try:
+            outputs = compiled(dict(constants, **{variable: inputs}))
+        except (ArithmeticError, ValueError, TypeError) as e:
+            raise ExpressionError(str(e), type(e).__name__) from e
+    # An expression without the variable still yields one value per input
+    outputs = np.broadcast_to(np.asarray(outputs, dtype=np.float64), inputs.shape)
+    return SweepTable(expression, variable, inputs, outputs)
+
+
+def sweep_range(expression, start, stop, count, variable=None, env=None):
+    _require_numpy()
+    return sweep(expression, np.linspace(start, stop, count), variable, env)
+
+
+def load_column(path, column=0):
+    # One numeric column of a CSV file ('#' starts a comment line)
+    _require_numpy()
+    return np.loadtxt(path, delimiter=",", usecols=column, ndmin=1, comments="#")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tabulate an expression over many inputs.")
+    parser.add_argument("expression", help="expression with one free variable, e.g. 'x² + 3x mod 7'")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--range", nargs=3, metavar=("START", "STOP", "COUNT"),
+                        help="COUNT evenly spaced values from START to STOP")
+    source.add_argument("--column", metavar="FILE[:N]",
+                        help="values from column N (default 0) of a CSV file")
+    parser.add_argument("--variable", help="name of the free variable (default: detected)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.range:
+            start, stop, count = args.range
+            table = sweep_range(args.expression, float(start), float(stop), int(count), args.variable)
+        else:
+            path, _, column = args.column.partition(":")
+            table = sweep(args.expression, load_column(path, int(column or 0)), args.variable)
+    except ExpressionError as e:
+        parser.error(str(e))
+
+    out = sys.stdout
+    out.write(f"{table.variable},result\n")
+    for x, y in zip(table.inputs, table.outputs):
+        out.write(f"{format_number(x)},{format_number(y)}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
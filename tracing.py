@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import time
+from collections import deque
+
+# Most recent samples kept per stage for the rolling percentiles
+DEFAULT_WINDOW = 4096
+
+# Stages of one keystroke, in the order they happen
+STAGES = ("mapping", "backend", "evaluate", "buffer", "paint", "total")
+
+
+def _percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class LatencyTracer:
+    # Timestamps each stage of handling an input event, from the moment the
+    # handler sees it until the frame clock paints the result. begin() starts
+    # a trace, mark(stage) records the time since the previous mark and
+    # painted() closes the trace once a buffer update has been drawn.
+    # A disabled tracer does nothing, so it can stay in the input path.
+
+    def __init__(self, enabled=True, window=DEFAULT_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self._start = None
+        self._last = None
+        self._awaiting_paint = False
+
+    def begin(self):
+        if not self.enabled:
+            return
+        self._start = self._last = time.perf_counter_ns()
+        self._awaiting_paint = False
+
+    def mark(self, stage):
+        if not self.enabled or self._start is None:
+            return
+        now = time.perf_counter_ns()
+        self.samples[stage].append(now - self._last)
+        self._last = now
+        if stage == "buffer":
+            self._awaiting_paint = True
+
+    def painted(self):
+        if not self.enabled or not self._awaiting_paint:
+            return
+        now = time.perf_counter_ns()
+        self.samples["paint"].append(now - self._last)
+        self.samples["total"].append(now - self._start)
+        self._start = self._last = None
+        self._awaiting_paint = False
+
+    def report(self):
+        stages = {}
+        for stage in STAGES:
+            ordered = sorted(self.samples[stage])
+            if not ordered:
+                continue
+            stages[stage] = {
+                "count": len(ordered),
+                "p50_ms": _percentile(ordered, 0.50) / 1e6,
+                "p95_ms": _percentile(ordered, 0.95) / 1e6,
+                "p99_ms": _percentile(ordered, 0.99) / 1e6,
+                "max_ms": ordered[-1] / 1e6,
+            }
+        return {"window": self.window, "stages": stages}
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+
+def _seconds_since_exec():
+    # How long ago this process started, from /proc; None where unavailable
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+
+
+class StartupTimer:
+    # Time from launch to the first painted frame, split into stages. mark()
+    # records the time since the previous mark; the report also has the time
+    # since the process was started, which includes the interpreter's own
+    # startup and the imports before this timer was created.
+
+    def __init__(self):
+        self.start = self._last = time.perf_counter()
+        self.since_exec = _seconds_since_exec()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = now - self._last
+        self._last = now
+
+    def report(self):
+        total = self._last - self.start
+        report = {"stages_ms": {stage: seconds * 1e3 for stage, seconds in self.stages.items()},
+                  "total_ms": total * 1e3}
+        if self.since_exec is not None:
+            report["since_exec_ms"] = (self.since_exec + total) * 1e3
+        return report
@@ -0,0 +1,115 @@
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, Gdk
+
+
+class HistoryView(Gtk.Box):
+    # Virtualized history list: only the rows currently scrolled into view
+    # are laid out and drawn, so the cost of a redraw does not depend on how
+    # many entries the model holds. The model needs __len__, __getitem__
+    # (entries with a format() method) and connect(callback).
+
+    def __init__(self, model):
+        super().__init__(orientation=Gtk.Orientation.HORIZONTAL, spacing=0)
+        self.model = model
+        self._row_height = None
+
+        self.adjustment = Gtk.Adjustment(value=0, lower=0, upper=0,
+                                         step_increment=1, page_increment=1, page_size=0)
+        self.adjustment.connect("value-changed", lambda adjustment: self.area.queue_draw())
+
+        self.area = Gtk.DrawingArea()
+        self.area.add_events(Gdk.EventMask.SCROLL_MASK | Gdk.EventMask.SMOOTH_SCROLL_MASK)
+        self.area.connect("draw", self.on_draw)
+        self.area.connect("scroll-event", self.on_scroll)
+        self.area.connect("size-allocate", lambda widget, allocation: self.update_adjustment())
+        self.area.connect("style-updated", self.on_style_updated)
+
+        scrollbar = Gtk.Scrollbar(orientation=Gtk.Orientation.VERTICAL, adjustment=self.adjustment)
+
+        self.pack_start(self.area, True, True, 0)
+        self.pack_start(scrollbar, False, False, 0)
+
+        # Models already notifying this view, see set_model()
+        self._connected = [model]
+        model.connect(lambda: self.on_model_changed() if self.model is model else None)
+
+    def on_style_updated(self, widget):
+        # Font may have changed, measure the row height again
+        self._row_height = None
+        self.update_adjustment()
+
+    def get_row_height(self):
+        if self._row_height is None:
+            layout = self.area.create_pango_layout("0")
+            self._row_height = max(1, layout.get_pixel_size()[1])
+        return self._row_height
+
+    def get_padding(self):
+        context = self.area.get_style_context()
+        return context.get_padding(context.get_state())
+
+    def update_adjustment(self, to_bottom=False):
+        padding = self.get_padding()
+        height = self.area.get_allocated_height()
+        content = len(self.model) * self.get_row_height() + padding.top + padding.bottom
+        upper = max(height, content)
+        # A view scrolled to the bottom stays there as entries are added,
+        # anywhere else it keeps its position
+        adjustment = self.adjustment
+        if adjustment.get_value() >= adjustment.get_upper() - adjustment.get_page_size() - 1:
+            to_bottom = True
+        value = upper - height if to_bottom else min(adjustment.get_value(), upper - height)
+        adjustment.configure(value, 0, upper, self.get_row_height(), height * 0.9, height)
+        self.area.queue_draw()
+
+    def on_model_changed(self):
+        self.update_adjustment()
+
+    def set_model(self, model):
+        # Show another model, e.g. search results, scrolled to the newest rows
+        if model is self.model:
+            return
+        if model not in self._connected:
+            model.connect(lambda: self.on_model_changed() if self.model is model else None)
+            self._connected.append(model)
+        self.model = model
+        self.update_adjustment(to_bottom=True)
+
+    def on_scroll(self, widget, event):
+        step = self.get_row_height() * 3
+        if event.direction == Gdk.ScrollDirection.UP:
+            delta = -step
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            delta = step
+        elif event.direction == Gdk.ScrollDirection.SMOOTH:
+            delta = event.get_scroll_deltas()[2] * step
+        else:
+            return False
+        adjustment = self.adjustment
+        limit = adjustment.get_upper() - adjustment.get_page_size()
+        adjustment.set_value(min(max(adjustment.get_value() + delta, 0), limit))
+        return True
+
+    def on_draw(self, widget, cr):
+        context = widget.get_style_context()
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        Gtk.render_background(context, cr, 0, 0, width, height)
+
+        padding = self.get_padding()
+        row_height = self.get_row_height()
+        count = len(self.model)
+
+        # Rows sit at the bottom while they don't fill the view (like valign END)
+        free_space = max(0, height - padding.top - padding.bottom - count * row_height)
+        top = padding.top + free_space - self.adjustment.get_value()
+
+        first = max(0, int(-top // row_height))
+        last = min(count, int((height - top) // row_height) + 1)
+
+        layout = widget.create_pango_layout("")
+        for index in range(first, last):
+            layout.set_text(self.model[index].format(), -1)
+            Gtk.render_layout(context, cr, padding.left, top + index * row_height, layout)
+        return False
@@ -0,0 +1,913 @@
+import json
+import os
+import signal
+import sys
+import tempfile
+
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, Gdk, Gio, GLib
+from backend import CalculatorBackend
+from engine import ExpressionError
+from editbuffer import text_diff
+from history import DEFAULT_CAPACITY, HistoryModel
+from historylog import HistoryLog
+from search import HistoryIndex, SearchResults
+from tracing import LatencyTracer, StartupTimer
+from widgets import HistoryView
+from workers import EvaluationPool
+
+# Map keyboard keys to calculator buttons, built once at import
+KEY_MAPPINGS = {
+    # Numbers
+    Gdk.KEY_0: "0", Gdk.KEY_1: "1", Gdk.KEY_2: "2", Gdk.KEY_3: "3", Gdk.KEY_4: "4",
+    Gdk.KEY_5: "5", Gdk.KEY_6: "6", Gdk.KEY_7: "7", Gdk.KEY_8: "8", Gdk.KEY_9: "9",
+    # Operations; 'x' is multiplication after an operand, where an operand
+    # goes it is the variable x (see on_key_press)
+    Gdk.KEY_plus: "+", Gdk.KEY_minus: "-", Gdk.KEY_asterisk: "×", Gdk.KEY_slash: "÷",
+    Gdk.KEY_x: "×", Gdk.KEY_X: "×",
+    Gdk.KEY_percent: "%", Gdk.KEY_period: ".", Gdk.KEY_comma: ".",
+    # Parentheses
+    Gdk.KEY_parenleft: "(", Gdk.KEY_parenright: ")",
+    # Equals and Enter
+    Gdk.KEY_equal: "=", Gdk.KEY_Return: "=", Gdk.KEY_KP_Enter: "=",
+    # Clear and backspace
+    Gdk.KEY_Escape: "C", Gdk.KEY_Delete: "C", Gdk.KEY_BackSpace: "BACKSPACE",
+    # Keypad numbers
+    Gdk.KEY_KP_0: "0", Gdk.KEY_KP_1: "1", Gdk.KEY_KP_2: "2", Gdk.KEY_KP_3: "3", Gdk.KEY_KP_4: "4",
+    Gdk.KEY_KP_5: "5", Gdk.KEY_KP_6: "6", Gdk.KEY_KP_7: "7", Gdk.KEY_KP_8: "8", Gdk.KEY_KP_9: "9",
+    # Keypad operations
+    Gdk.KEY_KP_Add: "+", Gdk.KEY_KP_Subtract: "-", Gdk.KEY_KP_Multiply: "×",
+    Gdk.KEY_KP_Divide: "÷", Gdk.KEY_KP_Decimal: ".", Gdk.KEY_KP_Equal: "="
+}
+
+# Seconds of history indexing per idle callback, well under a frame
+SEARCH_INDEX_SLICE = 0.004
+
+# Seconds the preview spends catching up with an edit per frame or idle
+# callback; a long expression edited near the start takes several
+PREVIEW_SLICE = 0.004
+
+# Inputs a table (Ctrl+T) runs over when there is no plot to take them from
+TABLE_RANGE = (0, 10)
+TABLE_ROWS = 11
+
+# Operators as the backend writes them and as they are shown
+DISPLAY_SYMBOLS = str.maketrans("*/", "×÷")
+
+# Styles needed for the first frame
+STARTUP_CSS = """
+@define-color window_bg_color #222226;
+@define-color window_fg_color #ffffff;
+@define-color view_bg_color #343437;
+@define-color view_fg_color #ffffff;
+@define-color accent_color #3584e4;
+@define-color accent_bg_color #1c71d8;
+
+* {
+    outline: none;
+}
+
+window {
+    background-color: @window_bg_color;
+    color: @window_fg_color;
+}
+
+.main-container {
+    background-color: @window_bg_color;
+}
+
+.history-search {
+    margin: 12px 12px 6px 12px;
+}
+
+.plot-area {
+    background-color: #3e3e41;
+    color: @accent_color;
+    border-radius: 8px;
+    margin: 0 12px 12px 12px;
+    padding: 8px 12px;
+    font-family: 'Consolas';
+    font-size: 13px;
+}
+
+.history-area {
+    background-color: #3e3e41;
+    border-radius: 8px 8px 0 0;
+    margin: 0 12px;
+    box-shadow: inset 0 1px 2px alpha(black, 0.1);
+}
+
+.typing-area {
+    background-color: #343437;
+    border-top: none;
+    border-radius: 0 0 8px 8px;
+    margin: 0 12px 12px 12px;
+    box-shadow: inset 0 1px 2px alpha(black, 0.1);
+}
+
+.separator {
+    margin: 0 12px;
+    min-height: 1px;
+}
+
+.history-display {
+    background-color: transparent;
+    color: @view_fg_color;
+    font-size: 24px;
+    font-weight: 500;
+    font-family: 'Consolas';
+    border: none;
+    padding: 15px 20px;
+}
+
+.typing-display {
+    background-color: transparent;
+    color: @view_fg_color;
+    font-size: 20px;
+    font-weight: 500;
+    font-family: 'Consolas';
+    border: none;
+    padding: 15px 20px;
+}
+
+.preview-display {
+    color: alpha(@view_fg_color, 0.6);
+    font-size: 16px;
+    font-family: 'Consolas';
+    padding: 0 20px 8px 20px;
+}
+
+.history-display text {
+    background-color: transparent;
+    color: @view_fg_color;
+}
+
+.typing-display text {
+    background-color: transparent;
+    color: @view_fg_color;
+}
+
+textview text {
+    background-color: transparent;
+    color: @view_fg_color;
+}
+
+button {
+    background: #3a3a3a;
+    background-image: none;
+    color: @window_fg_color;
+    font-size: 19px;
+    font-weight: bold;
+    font-family: 'Cantarell';
+    border: none;
+    border-radius: 10px;
+    min-height: 37px;
+    min-width: 45px;
+    margin: 1px;
+    box-shadow: 0 1px 2px alpha(black, 0.05);
+    text-shadow: none;
+    transition: all 200ms cubic-bezier(0.25, 0.46, 0.45, 0.94);
+}
+
+.number {
+    background: #4e4e51;
+}
+
+.operator {
+    background: #38383c;
+}
+
+.function {
+    background: #38383c;
+    font-weight: 600;
+}
+
+.equals {
+    background: #3584e4;
+    color: white;
+    font-weight: 700;
+}
+"""
+
+# Hover, press and focus styles, only needed once the window takes input;
+# loaded right after the first frame
+INTERACTION_CSS = """
+button:hover {
+    background: #404040;
+    box-shadow: 0 2px 4px alpha(black, 0.1);
+}
+
+button:active {
+    background: #2a2a2a;
+    box-shadow: inset 0 1px 2px alpha(black, 0.2);
+}
+
+button:focus {
+    box-shadow: 0 0 0 2px alpha(#3584e4, 0.3);
+}
+
+.number:hover {
+    background: #5a5a5d;
+}
+
+.operator:hover {
+    background: #3e3e42;
+}
+
+.function:hover {
+    background: #3e3e42;
+}
+
+.equals:hover {
+    background: #4094f0;
+}
+
+.equals:active {
+    background: #2574d8;
+}
+
+.equals:focus {
+    box-shadow: 0 0 0 2px alpha(white, 0.4);
+}
+"""
+
+# D-Bus name a running calculator is found by, so a second launch can
+# present its window instead of starting another process
+APPLICATION_ID = "org.example.Calculator"
+
+class Calculator(Gtk.Window):
+    def __init__(self, startup=None, measure_startup=False):
+        super().__init__(title="Calculator")
+        self.set_border_width(0)
+        self.set_resizable(True)
+        self.set_name("calculator-window")
+        
+        # Get screen dimensions and set window to full height
+        display = Gdk.Display.get_default()
+        monitor = display.get_primary_monitor() or display.get_monitor(0)
+        geometry = monitor.get_geometry()
+        screen_height = geometry.height
+        screen_width = geometry.width
+        
+        # Set calculator to use most of screen height but leave room for system UI
+        calc_width = min(713, int(screen_width * 0.59))  # Use 59% of screen width or 713px, whichever is smaller
+        calc_height = int(screen_height * 0.90)  # Use 90% of screen height to leave room for title bar, taskbar, etc.
+        self.set_default_size(calc_width, calc_height)
+        
+        # Set dark theme
+        self.set_app_paintable(True)
+        
+        # Force dark theme
+        settings = Gtk.Settings.get_default()
+        settings.set_property("gtk-application-prefer-dark-theme", True)
+        
+        self.backend = CalculatorBackend()
+        self.just_calculated = False  # Flag to track if we just got a result
+        
+        # Evaluations run in worker processes, results come back on the main loop
+        self.pool = EvaluationPool(post=GLib.idle_add)
+        self.connect("destroy", lambda widget: self.pool.close())
+        # Lines a redefined variable left stale are recomputed in a pool of
+        # their own, started the first time, so typing doesn't cancel them;
+        # the order is newest last
+        self.recompute_pool = None
+        self.recompute_order = []
+        
+        # CALC_TRACE=report.json turns on keystroke latency tracing; the report
+        # is written there on exit and whenever Ctrl+Shift+L is pressed
+        self.trace_path = os.environ.get("CALC_TRACE")
+        self.tracer = LatencyTracer(enabled=bool(self.trace_path))
+        if self.trace_path:
+            self.connect("realize", self.on_realize)
+            self.connect("destroy", lambda widget: self.dump_latency_report())
+        
+        # SIGUSR1 toggles cProfile/tracemalloc, SIGUSR2 writes the backend stats;
+        # files go to CALC_METRICS_DIR (default: the temp directory)
+        self.metrics_dir = os.environ.get("CALC_METRICS_DIR", tempfile.gettempdir())
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, self.on_toggle_profiling)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR2, self.on_dump_stats)
+
+        # Apply CSS styling first; the hover/press/focus rules aren't needed
+        # to draw the first frame and are added right after it
+        self.apply_css(STARTUP_CSS)
+        self.startup = startup or StartupTimer()
+        self.measure_startup = measure_startup
+        self.connect("realize", self.on_first_realize)
+        
+        # Main container - center the calculator content
+        outer_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=0)
+        outer_box.get_style_context().add_class("main-container")
+        
+        # Add expanding space on sides to center content
+        outer_box.pack_start(Gtk.Box(), True, True, 0)  # Left spacer
+        
+        main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
+        main_box.set_size_request(calc_width, calc_height)  # Fixed calculator size
+        outer_box.pack_start(main_box, False, False, 0)    # Calculator content (fixed)
+        
+        outer_box.pack_start(Gtk.Box(), True, True, 0)  # Right spacer
+        
+        self.add(outer_box)
+
+        # Working area container with fixed size
+        working_container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
+        working_container.set_size_request(calc_width - 24, 530)  # Fixed size: width minus margins, 530px height
+        
+        # History area - scrollable, only the visible rows are drawn. It
+        # starts out empty: the log is read after the first frame (or as soon
+        # as something needs it, see the history property).
+        self._history = None
+        history_area = HistoryView(HistoryModel(1))
+        history_area.get_style_context().add_class("history-area")
+        self.history_area = history_area
+        
+        self.history_view = history_area.area
+        self.history_view.get_style_context().add_class("history-display")
+        
+        # Search box over the history (Ctrl+F); Enter recalls the newest match.
+        # The index is built once the history is loaded.
+        self.search_index = None
+        self.search_results = None
+        self.indexing_source = None
+        
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text("Search history")
+        self.search_entry.get_style_context().add_class("history-search")
+        self.search_entry.connect("search-changed", self.on_search_changed)
+        self.search_entry.connect("activate", self.on_search_activate)
+        self.search_entry.connect("stop-search", lambda entry: self.end_search())
+        
+        # Separator line
+        separator = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL)
+        separator.get_style_context().add_class("separator")
+        
+        # Current typing area
+        typing_area = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
+        typing_area.get_style_context().add_class("typing-area")
+        
+        self.text_view = Gtk.TextView()
+        self.text_view.set_editable(True)
+        self.text_view.set_cursor_visible(True)
+        self.text_view.set_justification(Gtk.Justification.LEFT)
+        self.text_view.set_valign(Gtk.Align.START)
+        self.text_view.get_style_context().add_class("typing-display")
+        
+        self.text_buffer = self.text_view.get_buffer()
+        self.text_buffer.set_text("")
+        
+        # Input goes to the backend at once, the typing area and preview
+        # follow at most once per frame (see refresh_display)
+        self.display_tick = None
+        self.display_empty = ""
+        # Text last put in the buffer, None once something else has edited it
+        self.display_text = ""
+        self.updating_display = False
+        # Idle source finishing a preview that an edit made slow to catch up
+        self.preview_source = None
+        self.text_buffer.connect("changed", self.on_buffer_changed)
+        # Text pasted or typed into the view itself goes to the backend too
+        self.text_buffer.connect("insert-text", self.on_buffer_insert)
+        self.text_buffer.connect("delete-range", self.on_buffer_delete)
+        
+        typing_area.pack_start(self.text_view, True, True, 0)
+        
+        # Live result preview under the typing area
+        self.preview_label = Gtk.Label(label="")
+        self.preview_label.set_halign(Gtk.Align.END)
+        self.preview_label.get_style_context().add_class("preview-display")
+        typing_area.pack_start(self.preview_label, False, False, 0)
+        
+        # Pack everything together
+        working_container.pack_start(self.search_entry, False, False, 0)
+        working_container.pack_start(history_area, True, True, 0)
+        working_container.pack_start(separator, False, False, 0)
+        working_container.pack_start(typing_area, False, False, 0)
+        
+        # Set fixed heights
+        self.search_entry.set_size_request(-1, 34)  # Fixed 34px for the search box
+        history_area.set_size_request(-1, 380)  # Fixed 380px for history
+        typing_area.set_size_request(-1, 106)   # Fixed 106px for typing and preview
+        
+        main_box.pack_start(working_container, True, True, 0)
+        self.main_box = main_box
+        
+        # Plot of the expression in its free variable (Ctrl+P), built when
+        # first used, see toggle_plot()
+        self.plot_view = None
+
+        # Button grid - fixed size at bottom
+        button_container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
+        button_container.set_size_request(calc_width - 24, 220)  # Fixed size: 220px height
+        
+        self.grid = Gtk.Grid()
+        self.grid.set_row_homogeneous(True)
+        self.grid.set_column_homogeneous(True)
+        self.grid.set_row_spacing(2)
+        self.grid.set_column_spacing(2)
+        self.grid.set_margin_left(8)
+        self.grid.set_margin_right(8)
+        self.grid.set_margin_top(8)
+        self.grid.set_margin_bottom(8)
+        
+        button_container.pack_start(self.grid, True, True, 0)
+        main_box.pack_start(button_container, False, False, 0)
+
+        # Button layout to match the image exactly
+        buttons = [
+            # Row 0
+            ("C", 0, 0, "function"), ("(", 0, 1, "function"), (")", 0, 2, "function"), ("mod", 0, 3, "function"), ("π", 0, 4, "function"),
+            # Row 1  
+            ("7", 1, 0, "number"), ("8", 1, 1, "number"), ("9", 1, 2, "number"), ("÷", 1, 3, "operator"), ("√", 1, 4, "function"),
+            # Row 2
+            ("4", 2, 0, "number"), ("5", 2, 1, "number"), ("6", 2, 2, "number"), ("×", 2, 3, "operator"), ("x²", 2, 4, "function"),
+            # Row 3
+            ("1", 3, 0, "number"), ("2", 3, 1, "number"), ("3", 3, 2, "number"), ("-", 3, 3, "operator"), 
+            # Row 4
+            ("0", 4, 0, "number"), (".", 4, 1, "operator"), ("%", 4, 2, "operator"), ("+", 4, 3, "operator"),
+        ]
+
+        for (label, row, col, style_class) in buttons:
+            button = Gtk.Button(label=label)
+            button.connect("clicked", self.on_button_clicked)
+            button.get_style_context().add_class(style_class)
+            self.grid.attach(button, col, row, 1, 1)
+            
+        # Add equals button separately to span 2 rows
+        equals_button = Gtk.Button(label="=")
+        equals_button.connect("clicked", self.on_button_clicked)
+        equals_button.get_style_context().add_class("equals")
+        self.grid.attach(equals_button, 4, 3, 1, 2)  # Column 4, Row 3, Width 1, Height 2
+
+        # Enable keyboard input
+        self.set_can_focus(True)
+        self.set_focus_on_map(True)
+        self.connect("key-press-event", self.on_key_press)
+        
+        # Make sure window can receive all key events
+        self.add_events(Gdk.EventMask.KEY_PRESS_MASK)
+
+
+
+    def on_key_press(self, widget, event):
+        # Handle keyboard input
+        self.tracer.begin()
+        key = event.keyval
+        
+        # Ctrl+Shift+L writes the keystroke latency report
+        modifiers = event.state & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK)
+        if key in (Gdk.KEY_L, Gdk.KEY_l) and modifiers == (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK):
+            self.dump_latency_report()
+            return True
+        
+        # Ctrl+F searches the history; while the search box has focus it gets the keys
+        if key in (Gdk.KEY_F, Gdk.KEY_f) and modifiers == Gdk.ModifierType.CONTROL_MASK:
+            self.search_entry.grab_focus()
+            return True
+        if self.search_entry.has_focus():
+            return False
+
+        # Long results are shown in scientific notation. Ctrl+Shift+C copies
+        # every digit of the last result, Ctrl+E shows them in the typing area
+        if key in (Gdk.KEY_C, Gdk.KEY_c) and modifiers == (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK):
+            self.copy_full_result()
+            return True
+        if key in (Gdk.KEY_E, Gdk.KEY_e) and modifiers == Gdk.ModifierType.CONTROL_MASK:
+            if self.backend.expand_result():
+                self.refresh_display()
+            return True
+
+        # Ctrl+T adds a table of the expression's values to the history
+        if key in (Gdk.KEY_T, Gdk.KEY_t) and modifiers == Gdk.ModifierType.CONTROL_MASK:
+            self.tabulate()
+            return True
+
+        # Ctrl+P plots the expression ("x² - 2x"); again, with nothing new to plot, hides it
+        if key in (Gdk.KEY_P, Gdk.KEY_p) and modifiers == Gdk.ModifierType.CONTROL_MASK:
+            self.toggle_plot()
+            return True
+
+        # Ctrl+Z undoes the last edit, Ctrl+Shift+Z or Ctrl+Y redoes it
+        if key in (Gdk.KEY_Z, Gdk.KEY_z) and modifiers == Gdk.ModifierType.CONTROL_MASK:
+            button_label = "UNDO"
+        elif key in (Gdk.KEY_Z, Gdk.KEY_z, Gdk.KEY_Y, Gdk.KEY_y) and modifiers & Gdk.ModifierType.CONTROL_MASK:
+            button_label = "REDO"
+        elif key in (Gdk.KEY_x, Gdk.KEY_X) and not modifiers & Gdk.ModifierType.CONTROL_MASK:
+            # Decided at the cursor as the view has it, the user may have moved it
+            self.sync_cursor()
+            button_label = "x" if self.backend.expects_operand() else KEY_MAPPINGS[key]
+        else:
+            button_label = KEY_MAPPINGS.get(key)
+        # After a name, "=" starts assigning to it ("rate = 0.07"); Enter still evaluates
+        if key in (Gdk.KEY_equal, Gdk.KEY_KP_Equal) and self.backend.can_assign():
+            button_label = "ASSIGN"
+        if button_label is None:
+            return False  # Let other handlers process the key
+        self.tracer.mark("mapping")
+        
+        # Simulate button click
+        self.simulate_button_click(button_label)
+        return True  # Event handled
+    
+    def sync_cursor(self):
+        # Input goes where the text view's cursor is, unless the view hasn't
+        # caught up with earlier input yet
+        if self.display_tick is None:
+            insert = self.text_buffer.get_iter_at_mark(self.text_buffer.get_insert())
+            self.backend.move_cursor(insert.get_offset())
+
+    def simulate_button_click(self, label):
+        # Any new input supersedes an evaluation that is still running
+        self.pool.cancel()
+        
+        self.sync_cursor()
+        
+        # Simulate the button click logic
+        if label == "=":
+            # Evaluate off the main thread, on_result adds it to history
+            self.pool.submit("=", self.backend.expression, self.on_result, self.backend.seed, self.backend.env)
+            self.tracer.mark("backend")
+            return
+        elif label == "x²" and self.backend.unbound_names():
+            # In an expression to plot it is the "²" after an operand
+            self.backend.input(label)
+            self.tracer.mark("backend")
+            self.refresh_display()
+        elif label in ("√", "x²") and self.backend.expression:
+            # These evaluate the whole expression too, so they go to the pool as well
+            self.pool.submit(label, self.backend.expression, self.on_result, self.backend.seed, self.backend.env)
+            self.tracer.mark("backend")
+            return
+        elif label == "C":
+            self.backend.clear()
+            self.tracer.mark("backend")
+            self.refresh_display()
+            self.just_calculated = False  # Reset flag
+        elif label == "BACKSPACE":
+            # Handle backspace - check for selection first
+            if self.display_tick is None and self.text_buffer.get_has_selection():
+                # If text is selected (e.g., Ctrl+A), delete just that
+                start, end = self.text_buffer.get_selection_bounds()
+                self.backend.delete(start.get_offset(), end.get_offset())
+                self.tracer.mark("backend")
+                self.refresh_display()
+            else:
+                # No selection, remove the token before the cursor
+                current_expr = self.backend.expression
+                if current_expr and len(current_expr) > 0:
+                    # O(log n) edit in the backend's buffer, only the parser
+                    # states after the cursor are recomputed
+                    self.backend.backspace()
+                    self.tracer.mark("backend")
+                self.refresh_display()
+        elif label == "ASSIGN":
+            self.backend.input("=")
+            self.tracer.mark("backend")
+            self.just_calculated = False
+            self.refresh_display()
+        elif label in ("UNDO", "REDO"):
+            # Replays a stored edit delta, the expression is never snapshotted
+            if label == "UNDO":
+                self.backend.undo()
+            else:
+                self.backend.redo()
+            self.tracer.mark("backend")
+            self.just_calculated = False
+            self.refresh_display()
+        else:
+            # The backend has what the display will show, no need to read the buffer
+            current_text = self.backend.expression
+            
+            if (current_text == "0" or current_text == "") and label.isdigit():
+                self.backend.clear()
+            elif self.just_calculated and label.isdigit():
+                # If we just calculated and user types a number, start fresh
+                self.backend.clear()
+                self.just_calculated = False  # Clear flag after handling
+            elif self.just_calculated and label in ['+', '-', '×', '÷', '*', '/', '%', '(', ')']:
+                # If we just calculated and user types an operator, continue from result
+                self.just_calculated = False  # Clear flag after handling
+            
+            # Convert × back to * for backend processing
+            backend_label = label.replace('×', '*').replace('÷', '/')
+            self.backend.input(backend_label)
+            self.tracer.mark("backend")
+            
+            # Update only the typing area, "0" while it's empty
+            self.refresh_display("0")
+
+    def on_result(self, operation, expression, value, text, error, seconds=None, cache_hit=None):
+        # Called on the GTK main loop once a worker has finished
+        if expression != self.backend.expression:
+            return  # Input changed while evaluating
+        self.tracer.mark("evaluate")
+        if operation == "=":
+            self.show_result(expression, value, text, error, seconds, cache_hit)
+        else:
+            self.backend.apply(operation, value, text, error, seconds, cache_hit)
+            self.refresh_display("0")
+
+    def recompute_next(self):
+        # Submit the next stale line; a newer order supersedes the job running
+        sheet = self.backend.sheet
+        while self.recompute_order and self.recompute_order[-1] not in sheet.stale:
+            self.recompute_order.pop()
+        if not self.recompute_order:
+            return
+        if self.recompute_pool is None:
+            self.recompute_pool = EvaluationPool(size=1, post=GLib.idle_add)
+            self.connect("destroy", lambda widget: self.recompute_pool.close())
+        index = self.recompute_order.pop()
+        body, env = sheet.job(index)
+        self.recompute_pool.submit("=", body, lambda *outcome: self.on_recomputed(index, *outcome), env=env)
+
+    def on_recomputed(self, index, operation, expression, value, text, error, seconds=None, cache_hit=None):
+        sheet = self.backend.sheet
+        if index in sheet.stale:
+            sheet.update(index, value, text, error)
+            line = sheet.lines[index]
+            self.history.append(line.expression.translate(DISPLAY_SYMBOLS), line.text)
+        self.recompute_next()
+
+    @property
+    def history(self):
+        if self._history is None:
+            self.load_history()
+        return self._history
+
+    def load_history(self):
+        # CALC_HISTORY_LIMIT caps how many entries are kept before evicting the oldest
+        history_limit = int(os.environ.get("CALC_HISTORY_LIMIT", DEFAULT_CAPACITY))
+        
+        # History persists on disk (CALC_HISTORY_FILE, default under XDG_DATA_HOME);
+        # keep it in memory only if the log can't be opened or another
+        # instance (--new-instance) already has it open
+        try:
+            history = HistoryLog(os.environ.get("CALC_HISTORY_FILE"), history_limit)
+            self.connect("destroy", lambda widget: history.close())
+        except OSError:
+            history = HistoryModel(history_limit)
+        self._history = history
+        if self.search_results is None:
+            self.history_area.set_model(history)
+        
+        # The index catches up with existing history in idle time and picks up
+        # every new entry as it is added
+        self.search_index = HistoryIndex(history)
+        history.connect(self.schedule_indexing)
+        self.schedule_indexing()
+
+    def on_first_realize(self, widget):
+        clock = self.get_frame_clock()
+        handler = None
+        
+        def on_after_paint(clock):
+            clock.disconnect(handler)
+            self.startup.mark("first_frame")
+            GLib.idle_add(self.finish_startup)
+        
+        handler = clock.connect("after-paint", on_after_paint)
+
+    def finish_startup(self):
+        # What the first frame didn't need
+        self.apply_css(INTERACTION_CSS)
+        if self._history is None:
+            self.load_history()
+        self.startup.mark("deferred")
+        if self.measure_startup:
+            print(json.dumps(self.startup.report(), indent=2), file=sys.stderr)
+            self.destroy()
+        return GLib.SOURCE_REMOVE
+
+    def on_realize(self, widget):
+        # The frame clock tells us when a traced update has been painted
+        self.get_frame_clock().connect("after-paint", lambda clock: self.tracer.painted())
+
+    def on_toggle_profiling(self):
+        paths = self.backend.profiler.toggle(self.metrics_dir)
+        for path in paths:
+            print(f"Profile written to {path}")
+        return GLib.SOURCE_CONTINUE
+
+    def on_dump_stats(self):
+        path = os.path.join(self.metrics_dir, f"calculator-stats-{os.getpid()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.backend.stats(self.history), f, indent=2)
+            f.write("\n")
+        print(f"Stats written to {path}")
+        return GLib.SOURCE_CONTINUE
+
+    def dump_latency_report(self):
+        if self.trace_path:
+            self.tracer.dump(self.trace_path)
+
+    def show_result(self, current_expr, value, text, error, seconds=None, cache_hit=None):
+        # Add the calculation to history. The backend keeps the result as a
+        # value to continue from; text is it formatted to at most 9 decimals.
+        formatted_result = self.backend.apply("=", value, text, error, seconds, cache_hit)
+        if error is not None:
+            # Show the error in place of a result, typing a digit starts over
+            self.backend.expression = formatted_result
+        
+        # Replace * with × and / with ÷ for display purposes in the expression
+        display_expr = current_expr.translate(DISPLAY_SYMBOLS)
+        
+        # Append to the history model, O(1) regardless of history size
+        self.history.append(display_expr, formatted_result)
+        
+        # Calculations that used a variable this redefined are recomputed,
+        # their new results are added to the history as they come in
+        self.recompute_order = self.backend.sheet.stale_order()[::-1]
+        self.recompute_next()
+        
+        # Show only result in typing area
+        self.refresh_display()
+        self.just_calculated = True  # Set flag that we just calculated
+        
+        # The history view follows new entries while scrolled to the bottom
+
+    def copy_full_result(self):
+        # The digits are only worked out now, never for the display
+        text = self.backend.full_result()
+        if text is not None:
+            Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD).set_text(text, -1)
+
+    def tabulate(self):
+        # Values of the expression over its free variable: across the
+        # plotted range while a plot is shown, otherwise TABLE_RANGE
+        if not self.backend.expression:
+            return
+        # Imported here, like the plot, to keep NumPy out of startup
+        from sweep import sweep_range
+        
+        start, stop = TABLE_RANGE
+        if self.plot_view is not None and self.plot_view.get_visible():
+            start, stop = self.plot_view.x0, self.plot_view.x1
+        try:
+            table = sweep_range(self.backend.expression, start, stop, TABLE_ROWS, env=self.backend.env)
+        except (ExpressionError, ImportError) as e:
+            self.preview_label.set_text(str(e))
+            return
+        self.show_table(table)
+
+    def show_table(self, table):
+        # Show a sweep table (see sweep.py) in the history pane, one row per input
+        self.history.append(table.expression.translate(DISPLAY_SYMBOLS), f"{len(table)} values")
+        self.history.extend(table.rows())
+
+    def toggle_plot(self):
+        expression = self.backend.expression.translate(DISPLAY_SYMBOLS)
+        view = self.plot_view
+        if view is not None and view.get_visible() and expression in ("", view.expression):
+            view.hide()
+            return
+        if not expression:
+            return
+        # Imported here: NumPy alone would add tens of milliseconds to startup
+        from plot import compile_plot
+        from plotview import PlotView
+        
+        # Variables defined in the worksheet are constants in the plot
+        try:
+            _, function = compile_plot(self.backend.expression, self.backend.env)
+        except (ExpressionError, ImportError) as e:
+            self.preview_label.set_text(str(e))
+            return
+        if view is None:
+            # Between the working area and the buttons
+            view = self.plot_view = PlotView(post=GLib.idle_add)
+            view.get_style_context().add_class("plot-area")
+            view.set_size_request(self.main_box.get_allocated_width() - 24, 220)
+            self.main_box.pack_start(view, False, False, 0)
+            self.main_box.reorder_child(view, 1)
+        view.plot(expression, function)
+        view.show()
+
+    def schedule_indexing(self):
+        if self.indexing_source is None and self.search_index.pending:
+            self.indexing_source = GLib.idle_add(self.on_index_idle)
+
+    def on_index_idle(self):
+        if self.search_index.update(seconds=SEARCH_INDEX_SLICE):
+            return GLib.SOURCE_CONTINUE
+        self.indexing_source = None
+        # Show new entries in results that are on screen
+        if self.search_results is not None:
+            self.on_search_changed(self.search_entry)
+        return GLib.SOURCE_REMOVE
+
+    def on_search_changed(self, entry):
+        query = entry.get_text()
+        history = self.history
+        if not query.strip():
+            self.search_results = None
+            self.history_area.set_model(history)
+            return
+        self.search_results = SearchResults(self.search_index.search(query))
+        self.history_area.set_model(self.search_results)
+
+    def on_search_activate(self, entry):
+        # Enter puts the newest match back in the typing area
+        match = self.search_results.newest() if self.search_results is not None else None
+        if match is None:
+            return
+        self.pool.cancel()
+        self.backend.recall(match.expression)
+        self.just_calculated = False
+        self.refresh_display()
+        self.end_search()
+
+    def end_search(self):
+        self.search_entry.set_text("")
+        self.text_view.grab_focus()
+
+    def refresh_display(self, empty_text=""):
+        # Show the backend's expression (empty_text while there is none) on
+        # the next frame. However many keys arrive before then, the buffer
+        # and preview are updated once.
+        self.display_empty = empty_text
+        if self.display_tick is None:
+            self.display_tick = self.text_view.add_tick_callback(self.on_display_tick)
+
+    def on_display_tick(self, widget, frame_clock):
+        self.display_tick = None
+        text = self.backend.expression.translate(DISPLAY_SYMBOLS) or self.display_empty
+        self.updating_display = True
+        if self.display_text is None:
+            self.text_buffer.set_text(text)
+        else:
+            # Only the changed span is touched, typing at the end is an insert
+            # at the end iter and a backspace deletes one character
+            start, end, inserted = text_diff(self.display_text, text)
+            if end > start:
+                self.text_buffer.delete(self.text_buffer.get_iter_at_offset(start),
+                                        self.text_buffer.get_iter_at_offset(end))
+            if inserted:
+                self.text_buffer.insert(self.text_buffer.get_iter_at_offset(start), inserted)
+        self.updating_display = False
+        self.display_text = text
+        # Cursor where the backend has it
+        self.text_buffer.place_cursor(self.text_buffer.get_iter_at_offset(self.backend.cursor))
+        self.update_preview()
+        self.tracer.mark("buffer")
+        return GLib.SOURCE_REMOVE
+
+    def on_buffer_changed(self, buffer):
+        if not self.updating_display:
+            self.display_text = None
+
+    def showing_placeholder(self):
+        # The "0" shown for an empty expression isn't part of it
+        return not self.backend.expression and bool(self.display_text)
+
+    def on_buffer_insert(self, buffer, location, text, length):
+        # Runs before the buffer inserts, so location is still where text
+        # goes. A paste of any size is one backend edit; the view then
+        # catches up with what the backend made of it on the next frame.
+        if self.updating_display:
+            return
+        self.pool.cancel()
+        self.just_calculated = False
+        position = 0 if self.showing_placeholder() else location.get_offset()
+        self.backend.paste(text, position)
+        self.refresh_display()
+
+    def on_buffer_delete(self, buffer, start, end):
+        if self.updating_display:
+            return
+        self.pool.cancel()
+        if not self.showing_placeholder():
+            self.backend.delete(start.get_offset(), end.get_offset())
+        self.refresh_display()
+
+    def update_preview(self):
+        # The backend keeps incremental parser state, so this is O(1) per key
+        # at the end; after an edit further back it catches up in slices
+        if self.just_calculated:
+            self.preview_label.set_text("")
+            return
+        self.preview_label.set_text(self.backend.preview(PREVIEW_SLICE))
+        if self.backend.preview_pending and self.preview_source is None:
+            self.preview_source = GLib.idle_add(self.on_preview_idle)
+
+    def on_preview_idle(self):
+        self.preview_source = None
+        self.update_preview()
+        return GLib.SOURCE_REMOVE
+
+    def apply_css(self, css):
+        css_provider = Gtk.CssProvider()
+        css_provider.load_from_data(css.encode())
+        
+        screen = Gdk.Screen.get_default()
+        style_context = Gtk.StyleContext()
+        style_context.add_provider_for_screen(
+            screen, 
+            css_provider, 
+            Gtk.STYLE_PROVIDER_PRIORITY_USER
+        )
+
+    def on_button_clicked(self, widget):
+        self.tracer.begin()
+        label = widget.get_label()
+        self.simulate_button_click(label)
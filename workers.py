@@ -0,0 +1,173 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing.connection import wait
+
+from backend import timed_compute
+from engine import ExpressionTooLarge
+
+# Number of worker processes kept ready
+DEFAULT_WORKERS = 2
+
+# Seconds an evaluation may run before its worker is killed and replaced
+DEFAULT_DEADLINE = 5.0
+
+# Seconds a superseded evaluation may keep running before its worker is killed
+CANCEL_GRACE = 0.05
+
+
+def _worker_main(conn):
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        ticket, operation, expression, seed, env = job
+        conn.send((ticket,) + timed_compute(expression, operation, seed, env))
+
+
+def _context():
+    # Never fork the GTK process itself: forkserver (or spawn) workers only
+    # import the GTK-free backend (and re-run calc.py, which leaves GTK to
+    # window.py), and a preloaded forkserver makes replacing a killed
+    # worker cheap
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["workers"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class _Worker:
+    __slots__ = ("process", "conn", "job", "started")
+
+    def __init__(self, context):
+        parent, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = parent
+        self.job = None
+        self.started = None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+class EvaluationPool:
+    # Evaluates expressions in a small pool of prewarmed worker processes.
+    # Only the most recent request matters: submitting a new one (or calling
+    # cancel) supersedes whatever is queued or running, and a worker stuck on
+    # a superseded or overdue job is killed and replaced. Results are handed
+    # to post(callback, *args), e.g. GLib.idle_add to get back onto the GTK
+    # main loop; by default the callback runs on the pool's own thread.
+
+    def __init__(self, size=DEFAULT_WORKERS, deadline=DEFAULT_DEADLINE, post=None):
+        self.size = size
+        self.deadline = deadline
+        self._post = post or (lambda callback, *args: callback(*args))
+        self._lock = threading.Lock()
+        self._ticket = 0
+        self._current = None
+        self._pending = None
+        self._closed = False
+        self._wake_reader, self._wake_writer = multiprocessing.Pipe(duplex=False)
+        self._thread = threading.Thread(target=self._run, name="evaluation-pool", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, expression, callback, seed=None, env=None):
+        # callback(operation, expression, value, text, error, seconds, cache_hit)
+        # once the result is in (cache_hit is None when the worker timed out);
+        # seed and env (variable values) are passed on to compute()
+        with self._lock:
+            self._ticket += 1
+            self._current = self._ticket
+            self._pending = (self._ticket, operation, expression, seed, env, callback)
+        self._wake()
+        return self._ticket
+
+    def cancel(self):
+        with self._lock:
+            self._current = None
+            self._pending = None
+        self._wake()
+
+    def close(self):
+        self._closed = True
+        self.cancel()
+        self._thread.join()
+
+    def _wake(self):
+        self._wake_writer.send_bytes(b"")
+
+    def _run(self):
+        context = _context()
+        # Start the workers here so creating the pool never blocks the caller
+        workers = [_Worker(context) for _ in range(self.size)]
+        callbacks = {}
+
+        while not self._closed:
+            with self._lock:
+                idle = [worker for worker in workers if worker.job is None]
+                if self._pending is not None and idle:
+                    ticket, operation, expression, seed, env, callback = self._pending
+                    self._pending = None
+                    worker = idle[0]
+                    worker.conn.send((ticket, operation, expression, seed, env))
+                    worker.job = (ticket, operation, expression)
+                    worker.started = time.monotonic()
+                    callbacks[ticket] = callback
+
+            busy = [worker for worker in workers if worker.job is not None]
+            ready = wait([self._wake_reader] + [worker.conn for worker in busy],
+                         timeout=CANCEL_GRACE if busy else None)
+
+            if self._wake_reader in ready:
+                while self._wake_reader.poll():
+                    self._wake_reader.recv_bytes()
+
+            now = time.monotonic()
+            for index, worker in enumerate(workers):
+                if worker.job is None:
+                    continue
+                ticket, operation, expression = worker.job
+                if worker.conn in ready:
+                    try:
+                        _, *outcome = worker.conn.recv()
+                    except (EOFError, OSError):
+                        # Worker died, replace it and drop its job
+                        worker.kill()
+                        workers[index] = _Worker(context)
+                        callbacks.pop(ticket, None)
+                        continue
+                    worker.job = None
+                    self._deliver(ticket, callbacks.pop(ticket), operation, expression, *outcome)
+                elif ticket != self._current and now - worker.started > CANCEL_GRACE:
+                    # Superseded and still busy: don't let it hold a worker
+                    worker.kill()
+                    workers[index] = _Worker(context)
+                    callbacks.pop(ticket, None)
+                elif now - worker.started > self.deadline:
+                    worker.kill()
+                    workers[index] = _Worker(context)
+                    error = ExpressionTooLarge("seconds", round(now - worker.started, 3), self.deadline)
+                    self._deliver(ticket, callbacks.pop(ticket), operation, expression,
+                                  None, "Too large", error, now - worker.started, None)
+
+        for worker in workers:
+            if worker.job is None:
+                worker.conn.send(None)
+                worker.process.join(1)
+            else:
+                worker.kill()
+
+    def _deliver(self, ticket, callback, operation, expression, *outcome):
+        with self._lock:
+            if ticket != self._current:
+                return
+            self._current = None
+        self._post(callback, operation, expression, *outcome)
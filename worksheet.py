@@ -0,0 +1,219 @@
+from collections import deque
+from functools import lru_cache
+
+from engine import (CACHE_SIZE, ExpressionError, ExpressionTooLarge, evaluate, free_names,
+                    parse_expression, split_assignment)
+from formatting import format_value
+
+_ANS_ONLY = frozenset({"ans"})
+
+# Most calculations kept besides the variable definitions; past this the
+# oldest is dropped, and a line that continued from it keeps its value as ans
+MAX_LINES = 1000
+
+
+class Line:
+    # One calculation. reads are the variable names its expression uses,
+    # ans the index of the line it continues from (None if it doesn't use
+    # ans, or ans was a result that isn't a line), seed the value of ans then.
+    __slots__ = ("expression", "name", "body", "reads", "ans", "seed", "value", "text", "error")
+
+    def __init__(self, expression, name, body, reads, ans, seed, value, text):
+        self.expression = expression
+        self.name = name
+        self.body = body
+        self.reads = reads
+        self.ans = ans
+        self.seed = seed
+        self.value = value
+        self.text = text
+        self.error = None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _references(expression):
+    # (assigned name or None, body, names the body reads)
+    name, body = split_assignment(expression)
+    return name, body, frozenset(free_names(parse_expression(body)))
+
+
+class Worksheet:
+    # Calculations kept as a dependency graph, like a small spreadsheet. A
+    # line reads variables and maybe ans, and may define a variable
+    # ("rate = 0.07"). Assigning to a name that already has a line replaces
+    # that line's expression, and then only the lines depending on it,
+    # directly or through other lines, go stale. Stale lines are recomputed
+    # by the caller, each once, in topological order (stale_order, job and
+    # update), so the evaluations can run wherever the caller evaluates; the
+    # recompute() method does it in this process. An assignment that would
+    # make a name depend on itself is rejected.
+
+    def __init__(self, max_lines=MAX_LINES):
+        self.max_lines = max_lines
+        # Index -> line, oldest first; indexes aren't reused
+        self.lines = {}
+        self._next = 0
+        # Variable name -> index of the line defining it
+        self.variables = {}
+        # Variable name or line index -> indexes of the lines reading it
+        self._readers = {}
+        # Indexes of the lines not defining a variable, oldest first
+        self._calculations = deque()
+        # Indexes of the lines whose value is out of date
+        self.stale = set()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def values(self):
+        # Current value of every variable that has one
+        values = {}
+        for name, index in self.variables.items():
+            line = self.lines[index]
+            if line.error is None:
+                values[name] = line.value
+        return values
+
+    def _sources(self, line):
+        # Keys a line reads from, see _readers
+        sources = [name for name in line.reads if name != "ans"]
+        if line.ans is not None and "ans" in line.reads:
+            sources.append(line.ans)
+        return sources
+
+    def _link(self, index):
+        for source in self._sources(self.lines[index]):
+            self._readers.setdefault(source, set()).add(index)
+
+    def _unlink(self, index):
+        for source in self._sources(self.lines[index]):
+            readers = self._readers.get(source)
+            if readers is not None:
+                readers.discard(index)
+
+    def _drop(self, index):
+        # Forget a calculation; the lines continuing from it keep its value
+        self._unlink(index)
+        line = self.lines.pop(index)
+        for reader in self._readers.pop(index, ()):
+            self.lines[reader].ans = None
+            self.lines[reader].seed = line.value
+        self.stale.discard(index)
+
+    def _dependents(self, index):
+        # Indexes of the lines that read line index itself
+        line = self.lines[index]
+        dependents = set(self._readers.get(index, ()))
+        if line.name is not None and self.variables.get(line.name) == index:
+            dependents |= self._readers.get(line.name, set())
+        return dependents
+
+    def _affected(self, index):
+        # Every line depending on line index, directly or not
+        affected = set()
+        stack = [index]
+        while stack:
+            for dependent in self._dependents(stack.pop()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+        return affected
+
+    def stale_order(self):
+        # The stale lines in an order to recompute them: Kahn's algorithm,
+        # a line comes once everything it reads that is stale is before it
+        waiting = {index: 0 for index in self.stale}
+        for index in self.stale:
+            for dependent in self._dependents(index):
+                if dependent in waiting:
+                    waiting[dependent] += 1
+        ready = sorted((index for index, count in waiting.items() if count == 0), reverse=True)
+        order = []
+        while ready:
+            index = ready.pop()
+            order.append(index)
+            for dependent in self._dependents(index):
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+        return order
+
+    def job(self, index):
+        # (body, env) to evaluate line index with, the values it reads now
+        line = self.lines[index]
+        env = {}
+        for name in line.reads:
+            source = self.variables.get(name)
+            if source is not None and self.lines[source].error is None:
+                env[name] = self.lines[source].value
+        if "ans" in line.reads:
+            if line.ans is None:
+                env["ans"] = line.seed
+            elif self.lines[line.ans].error is None:
+                env["ans"] = self.lines[line.ans].value
+        return line.body, env
+
+    def update(self, index, value, text, error=None):
+        # Store the recomputed value of line index, if it is still stale
+        if index in self.stale:
+            line = self.lines[index]
+            line.value, line.text, line.error = value, text, error
+            self.stale.discard(index)
+
+    def recompute(self):
+        # Bring every stale line up to date here; returns their indexes in
+        # the order they were recomputed
+        order = self.stale_order()
+        for index in order:
+            body, env = self.job(index)
+            try:
+                value = evaluate(body, env)
+                self.update(index, value, format_value(value))
+            except ExpressionTooLarge as e:
+                self.update(index, None, "Too large", e)
+            except ExpressionError as e:
+                self.update(index, None, "Error", e)
+        return order
+
+    def record(self, expression, value, text, ans=None, seed=None):
+        # Add a calculation that has just been evaluated to value, or update
+        # the line defining its variable. ans is the index of the line the
+        # result used as ans came from, seed that result. Returns the line's
+        # index, None for a calculation with no variables or ans, which is
+        # not kept. Lines depending on a redefined variable go stale.
+        name, body, reads = _references(expression)
+        if name is None and (not reads or reads == _ANS_ONLY and ans is None):
+            # Nothing can change its value, so there is nothing to keep
+            return None
+        if ans not in self.lines:
+            ans = None
+        index = self.variables.get(name) if name is not None else None
+        line = Line(expression, name, body, reads, ans, seed, value, text)
+        if index is None:
+            if name in reads:
+                raise ExpressionError(f"circular reference: {name} depends on itself", "cycle")
+            index = self._next
+            self._next += 1
+            self.lines[index] = line
+            if name is not None:
+                self.variables[name] = index
+            else:
+                self._calculations.append(index)
+            self._link(index)
+            while len(self._calculations) > self.max_lines:
+                self._drop(self._calculations.popleft())
+            return index
+
+        # Redefining a variable: what it now reads must not depend on it
+        affected = self._affected(index)
+        for source in self._sources(line):
+            source_index = self.variables.get(source) if isinstance(source, str) else source
+            if source_index == index or source_index in affected:
+                raise ExpressionError(f"circular reference: {name} depends on itself", "cycle")
+        self._unlink(index)
+        self.lines[index] = line
+        self._link(index)
+        self.stale |= affected
+        self.stale.discard(index)
+        return index